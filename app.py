@@ -1,9 +1,90 @@
-from flask import Flask, render_template, request
-from markupsafe import Markup # Import Markup from markupsafe
+import functools
+import gzip
+import hashlib
+import json
+import logging
+import os
+import time
+from flask import Flask, render_template, request, jsonify, g, Response, stream_with_context
+from markupsafe import Markup, escape # Import Markup from markupsafe
+import metrics
 import ug_scraper # Import the scraper module
 
+try:
+    import brotli
+except ImportError: # Optional; /api/chords falls back to gzip without it
+    brotli = None
+
+# Set CHORDBOT_LOG_LEVEL=WARNING in production to drop the per-request logging
+logging.basicConfig(
+    level=os.environ.get('CHORDBOT_LOG_LEVEL', 'INFO').upper(),
+    format='%(asctime)s %(levelname)s %(name)s: %(message)s',
+)
+logger = logging.getLogger(__name__)
+
+# Limits for /api/batch (gunicorn.conf.py keeps the worker timeout above BATCH_MAX_TIMEOUT)
+BATCH_MAX_QUERIES = int(os.environ.get('CHORDBOT_BATCH_MAX_QUERIES', '50'))
+BATCH_DEFAULT_CONCURRENCY = int(os.environ.get('CHORDBOT_BATCH_CONCURRENCY', '4'))
+BATCH_MAX_CONCURRENCY = int(os.environ.get('CHORDBOT_BATCH_MAX_CONCURRENCY', '8'))
+BATCH_DEFAULT_TIMEOUT = float(os.environ.get('CHORDBOT_BATCH_TIMEOUT', '60'))
+BATCH_MAX_TIMEOUT = float(os.environ.get('CHORDBOT_BATCH_MAX_TIMEOUT', '120'))
+
+# HTTP caching for /api/chords: max-age caps (seconds) for found, not-found and
+# failed lookups, and the smallest body worth compressing
+API_MAX_AGE = int(os.environ.get('CHORDBOT_API_MAX_AGE', '86400'))
+API_NEGATIVE_MAX_AGE = int(os.environ.get('CHORDBOT_API_NEGATIVE_MAX_AGE', '300'))
+API_ERROR_MAX_AGE = int(os.environ.get('CHORDBOT_API_ERROR_MAX_AGE', '30'))
+API_STALE_WHILE_REVALIDATE = int(os.environ.get('CHORDBOT_API_STALE_WHILE_REVALIDATE', '3600'))
+COMPRESS_MIN_BYTES = int(os.environ.get('CHORDBOT_COMPRESS_MIN_BYTES', '1024'))
+
 app = Flask(__name__)
 
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, route=route)
+    return response
+
+def format_result_html(chords_result: str) -> Markup:
+    """
+    Basic formatting for HTML display (preserve line breaks).
+    """
+    # Replace newlines with <br> tags
+    formatted_result = chords_result.replace('\n', '<br>')
+    return Markup(f"<pre>{formatted_result}</pre>") # Wrap in <pre> for formatting
+
+def format_entry_html(query: str, entry, transpose: int = 0, capo: int = 0) -> Markup:
+    """
+    Renders a lookup result: the chord sheet in the requested key, or the error message.
+    """
+    sheet = ug_scraper.song_sheet(entry)
+    if sheet is None:
+        return format_result_html(str(escape(ug_scraper.missing_message(query, entry))))
+    return Markup(sheet.html(transpose, capo))
+
+def parse_key_change(values) -> tuple[int, int]:
+    """
+    Reads the transpose (semitones) and capo (fret) fields, clamped to sensible ranges.
+    """
+    def number(name, low, high):
+        try:
+            return max(low, min(high, int(values.get(name) or 0)))
+        except ValueError:
+            return 0
+    return number('transpose', -11, 11), number('capo', 0, 11)
+
+def warm_up():
+    """
+    Warms the scraper caches and compiles the page template, for a master
+    process that forks its workers afterwards (see gunicorn.conf.py).
+    """
+    ug_scraper.warm_up()
+    app.jinja_env.get_template('index.html')
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     """
@@ -12,29 +93,255 @@ def index():
     query = ""
     result_html = "" # Use Markup to render HTML safely
     error = ""
+    transpose, capo = parse_key_change(request.form)
 
     if request.method == 'POST':
         query = request.form.get('query', '').strip()
         if query:
             try:
-                print(f"Received query: {query}")
-                # Call the scraper function from the imported module
-                chords_result = ug_scraper.get_song_chords(query)
-                print(f"Scraper returned: {chords_result[:100]}...") # Log snippet
+                logger.info("Received query: %s", query)
+                # Cached after the first search, so changing key doesn't scrape again
+                entry = ug_scraper.lookup_song_chords(query)
+                logger.debug("Scraper returned: %s...", (entry.content or entry.error or '')[:100]) # Log snippet
 
-                # Basic formatting for HTML display (preserve line breaks)
-                # Replace newlines with <br> tags
-                formatted_result = chords_result.replace('\n', '<br>')
-                result_html = Markup(f"<pre>{formatted_result}</pre>") # Wrap in <pre> for formatting
+                result_html = format_entry_html(query, entry, transpose, capo)
 
             except Exception as e:
-                print(f"Error during scraping or processing: {e}")
+                logger.exception("Error during scraping or processing: %s", e)
                 error = f"An unexpected error occurred: {e}"
         else:
             error = "Please enter a song title and artist."
 
     # Render the template, passing the query, result, and error message
-    return render_template('index.html', query=query, result_html=result_html, error=error)
+    return render_template('index.html', query=query, result_html=result_html, error=error, transpose=transpose, capo=capo)
+
+def sse_event(event: str, data) -> str:
+    """
+    One server-sent event with a JSON payload.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/stream')
+def stream():
+    """
+    Progress stream for the search form: GET /stream?q=Wonderwall+Oasis[&transpose=2][&capo=1]
+
+    Server-sent events: 'provider' as each provider is tried and finishes,
+    then a single 'result' with the rendered sheet. Comment lines go out
+    straight away and every CHORDBOT_STREAM_KEEPALIVE seconds while the
+    providers are slow, so proxies don't close the idle connection.
+    """
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify(error="Missing 'q' (song title and artist)."), 400
+    transpose, capo = parse_key_change(request.args)
+    logger.info("Received streamed query: %s", query)
+
+    def generate():
+        yield ": searching\n\n"
+        for kind, data in ug_scraper.stream_song_chords(query):
+            if kind == 'keepalive':
+                yield ": keepalive\n\n"
+            elif kind == 'provider':
+                yield sse_event('provider', data)
+            else:
+                yield sse_event('result', {
+                    'found': data.found,
+                    'provider': data.provider,
+                    'html': str(format_entry_html(query, data, transpose, capo)),
+                })
+
+    # X-Accel-Buffering stops nginx-style proxies from holding the events back
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/stats/cache')
+def cache_stats():
+    """
+    Returns the result cache's hit, miss and eviction counters, the search
+    index's hits and the background refresher's state for this worker.
+    """
+    return jsonify({**ug_scraper.RESULT_CACHE.stats(), 'search_index': ug_scraper.SEARCH_INDEX.stats(),
+                    'refresher': ug_scraper.REFRESHER.stats()})
+
+
+@app.route('/stats/providers')
+def provider_stats():
+    """
+    Returns each provider's rolling hit rate, latency and circuit breaker state for this worker.
+    """
+    return jsonify(ug_scraper.SCHEDULER.snapshot())
+
+@app.route('/api/batch', methods=['POST'])
+def batch():
+    """
+    Resolves a setlist in one request.
+
+    Expects JSON like {"queries": ["Wonderwall Oasis", ...], "concurrency": 4, "timeout": 60}
+    and streams back one JSON object per line as each song finishes (not in input order).
+    """
+    payload = request.get_json(silent=True) or {}
+    queries = payload.get('queries')
+    if not isinstance(queries, list) or not queries or not all(isinstance(q, str) and q.strip() for q in queries):
+        return jsonify(error="'queries' must be a non-empty list of song titles."), 400
+    if len(queries) > BATCH_MAX_QUERIES:
+        return jsonify(error=f"At most {BATCH_MAX_QUERIES} queries per batch."), 400
+    try:
+        concurrency = int(payload.get('concurrency', BATCH_DEFAULT_CONCURRENCY))
+        timeout = float(payload.get('timeout', BATCH_DEFAULT_TIMEOUT))
+    except (TypeError, ValueError):
+        return jsonify(error="'concurrency' and 'timeout' must be numbers."), 400
+    if concurrency <= 0 or timeout <= 0:
+        return jsonify(error="'concurrency' and 'timeout' must be positive."), 400
+    concurrency = min(concurrency, BATCH_MAX_CONCURRENCY)
+    timeout = min(timeout, BATCH_MAX_TIMEOUT)
+
+    queries = [q.strip() for q in queries]
+    logger.info("Received batch of %d queries", len(queries))
+
+    def generate():
+        for index, query, entry in ug_scraper.iter_song_chords(queries, concurrency, timeout):
+            yield json.dumps({
+                'index': index,
+                'query': query,
+                'found': entry.found,
+                'provider': entry.provider,
+                'chords': ug_scraper.song_sheet(entry).text() if entry.found else None,
+                'error': entry.error,
+            }) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@functools.lru_cache(maxsize=256)
+def render_api_body(fmt: str, query: str, transpose: int, capo: int, include_sheet: bool, entry) -> tuple[bytes, str]:
+    """
+    Builds the /api/chords body for a lookup result and its content-hash ETag.
+    Memoized, so repeat views of the same result skip rendering and hashing.
+    """
+    if fmt == 'html':
+        body = render_template('index.html', query=query, result_html=format_entry_html(query, entry, transpose, capo),
+                               error="", transpose=transpose, capo=capo)
+    else:
+        sheet = ug_scraper.song_sheet(entry)
+        body = json.dumps({
+            'query': query,
+            'found': entry.found,
+            'provider': entry.provider,
+            'key': sheet.key_for(transpose) if sheet else None,
+            'transpose': transpose,
+            'capo': capo,
+            'chords': sheet.text(transpose, capo) if sheet else None,
+            'sheet': sheet.to_dict() if sheet and include_sheet else None,
+            'error': None if sheet else ug_scraper.missing_message(query, entry),
+        })
+    body = body.encode('utf-8')
+    return body, hashlib.sha1(body).hexdigest()[:20]
+
+@functools.lru_cache(maxsize=256)
+def compress_body(body: bytes, encoding: str) -> bytes:
+    """
+    Gzip or brotli version of a body (memoized; the bodies come from render_api_body).
+    """
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+def pick_encoding(size: int) -> str | None:
+    """
+    The best Content-Encoding the client accepts for a body of `size` bytes, if any.
+    """
+    if size < COMPRESS_MIN_BYTES:
+        return None
+    offered = ['br', 'gzip'] if brotli is not None else ['gzip']
+    best = max(offered, key=lambda encoding: request.accept_encodings[encoding])
+    return best if request.accept_encodings[best] > 0 else None
+
+def cache_control(entry) -> str:
+    """
+    Cache-Control for a lookup result, following how long it stays fresh in our cache.
+    """
+    remaining = int(entry.expires_at - time.time())
+    if entry.found:
+        if remaining <= 0:
+            # Served stale while the refresher fetches a new copy
+            return f"public, max-age=0, stale-while-revalidate={API_STALE_WHILE_REVALIDATE}"
+        return f"public, max-age={min(remaining, API_MAX_AGE)}, stale-while-revalidate={API_STALE_WHILE_REVALIDATE}"
+    if remaining <= 0:
+        return "no-store" # Not cached on our side either, e.g. a coalescing timeout
+    # A plain miss is as final as a hit; a lookup where providers failed may succeed on retry
+    failed = entry.outcome in ('error', 'timeout')
+    return f"public, max-age={min(remaining, API_ERROR_MAX_AGE if failed else API_NEGATIVE_MAX_AGE)}"
+
+@app.route('/api/chords')
+def chords_api():
+    """
+    Cacheable lookup: GET /api/chords?q=Wonderwall+Oasis[&transpose=2][&capo=1][&format=json|html][&sheet=1]
+
+    Returns JSON (default; sheet=1 adds the parsed lines) or the HTML page,
+    with a content-hash ETag (304 on a matching If-None-Match), Cache-Control
+    based on the result's freshness and gzip/brotli compression for larger bodies.
+    Pass url=<a url from /api/versions> instead of (or along with) q to get that version.
+    """
+    query = request.args.get('q', '').strip()
+    url = request.args.get('url', '').strip()
+    if not query and not url:
+        return jsonify(error="Missing 'q' (song title and artist)."), 400
+    fmt = request.args.get('format') or request.accept_mimetypes.best_match(['application/json', 'text/html'], 'application/json')
+    fmt = 'html' if fmt in ('html', 'text/html') else 'json'
+    transpose, capo = parse_key_change(request.args)
+
+    if url:
+        entry = ug_scraper.lookup_version(url)
+        if entry is None:
+            return jsonify(error="Unknown version; pick a 'url' from /api/versions."), 404
+        query = query or url
+    else:
+        entry = ug_scraper.lookup_song_chords(query)
+    body, digest = render_api_body(fmt, query, transpose, capo, request.args.get('sheet') == '1', entry)
+    encoding = pick_encoding(len(body))
+    etag = f"{digest}-{encoding}" if encoding else digest
+
+    headers = {
+        'Cache-Control': cache_control(entry),
+        'Vary': 'Accept, Accept-Encoding',
+        'ETag': f'"{etag}"',
+    }
+    # Any encoding of the same content counts as a match
+    if any(request.if_none_match.contains_weak(tag) for tag in (digest, f"{digest}-gzip", f"{digest}-br")):
+        return Response(status=304, headers=headers)
+    if encoding:
+        body = compress_body(body, encoding)
+        headers['Content-Encoding'] = encoding
+    mimetype = 'text/html' if fmt == 'html' else 'application/json'
+    return Response(body, mimetype=mimetype, headers=headers)
+
+@app.route('/api/versions')
+def versions_api():
+    """
+    Alternate versions: GET /api/versions?q=Wonderwall+Oasis
+
+    Returns every candidate the providers listed for the song (from the
+    search index, looking the song up first if nothing is indexed yet). Each url can be
+    passed to /api/chords?url=... to get that version.
+    """
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify(error="Missing 'q' (song title and artist)."), 400
+    versions = ug_scraper.song_versions(query)
+    if not versions:
+        ug_scraper.lookup_song_chords(query)
+        versions = ug_scraper.song_versions(query)
+    return jsonify(query=query, versions={
+        provider: [candidate._asdict() for candidate in candidates]
+        for provider, candidates in versions.items()
+    })
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """
+    Prometheus scrape endpoint: per-stage latency histograms, provider outcomes and cache counters.
+    """
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 # The following block is typically not used when deploying with Gunicorn on Render
 # if __name__ == '__main__':
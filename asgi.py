@@ -0,0 +1,85 @@
+# ASGI entry point
+#
+# Serves /async from the async scraper on the event loop, so a worker is not
+# pinned while it waits on upstream sites, and hands every other path to the
+# Flask app. Run it with an ASGI worker class, e.g.:
+#   gunicorn -k uvicorn.workers.UvicornWorker --bind 0.0.0.0:8080 asgi:application
+import asyncio
+import logging
+import urllib.parse
+
+from asgiref.wsgi import WsgiToAsgi
+
+import app as flask_app
+import async_scraper
+
+logger = logging.getLogger(__name__)
+
+_flask_asgi = WsgiToAsgi(flask_app.app)
+
+
+async def _read_body(receive) -> bytes:
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    return body
+
+
+async def async_index(scope, receive, send):
+    """
+    Async counterpart of app.index: shows the form (GET) and looks up the
+    query (POST) without blocking the worker.
+    """
+    query = ""
+    result_html = ""
+    error = ""
+    transpose, capo = 0, 0
+
+    if scope['method'] == 'POST':
+        form = {name: values[0] for name, values in
+                urllib.parse.parse_qs((await _read_body(receive)).decode('utf-8', errors='replace')).items()}
+        query = form.get('query', '').strip()
+        transpose, capo = flask_app.parse_key_change(form)
+        if query:
+            try:
+                logger.info("Received async query: %s", query)
+                entry = await async_scraper.lookup_song_chords(query)
+                # Rendering parses the sheet, which is CPU work; keep it off the event loop
+                result_html = await asyncio.to_thread(flask_app.format_entry_html, query, entry, transpose, capo)
+            except Exception as e:
+                logger.exception("Error during scraping or processing: %s", e)
+                error = f"An unexpected error occurred: {e}"
+        else:
+            error = "Please enter a song title and artist."
+
+    template = flask_app.app.jinja_env.get_template('index.html')
+    page = template.render(query=query, result_html=result_html, error=error, transpose=transpose, capo=capo).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', b'text/html; charset=utf-8'), (b'content-length', str(len(page)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': page})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await async_scraper.aclose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+    elif scope['type'] == 'http' and scope['path'] == '/async':
+        await async_index(scope, receive, send)
+    else:
+        await _flask_asgi(scope, receive, send)
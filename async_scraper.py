@@ -0,0 +1,314 @@
+# Async variant of ug_scraper
+#
+# Same providers, fallback order, cache and coalescing as ug_scraper, but built
+# on a non-blocking HTTP client so one event loop can serve many lookups at
+# once. The providers, page parsing and caching rules are ug_scraper's; only
+# the fetching and the orchestration around it are async here. Parsing and the
+# SQLite-backed cache and search index are blocking, so they run in worker
+# threads (asyncio.to_thread) rather than on the event loop.
+import asyncio
+import functools
+import logging
+import random
+import time
+
+import httpx
+
+import chord_cache
+import metrics
+import singleflight
+import ug_scraper
+from ug_scraper import ScraperError
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = (500, 502, 503, 504)
+
+# --- HTTP Client ---
+# One pooled client per event loop; httpx keeps connections alive per host.
+_client = None
+_client_loop = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """Returns the shared client for the running event loop, creating it on first use."""
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client_loop is not loop:
+        proxy = ug_scraper.PA_PROXY['https'] if ug_scraper.PA_PROXY and not ug_scraper.UPSTREAM_OVERRIDE else None
+        transport = httpx.AsyncHTTPTransport(
+            retries=ug_scraper.HTTP_RETRIES, # Connection errors only; 5xx are retried in fetch_page
+            limits=httpx.Limits(max_keepalive_connections=ug_scraper.HTTP_POOL_SIZE),
+            proxy=proxy,
+        )
+        _client = httpx.AsyncClient(transport=transport)
+        _client_loop = loop
+    return _client
+
+
+async def aclose():
+    """Closes the shared client, e.g. on ASGI lifespan shutdown."""
+    global _client, _client_loop
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+        _client_loop = None
+
+
+def after_fork():
+    """Drops a client inherited from the parent process; each worker opens its own."""
+    global _client, _client_loop
+    _client = None
+    _client_loop = None
+
+
+def _backoff(attempt: int) -> float:
+    return ug_scraper.HTTP_BACKOFF * (2 ** attempt) + random.uniform(0, ug_scraper.HTTP_BACKOFF_JITTER)
+
+
+async def fetch_page(url: str, stop_at: list | None = None, encoding: str | None = None,
+                     max_bytes: int = ug_scraper.MAX_PAGE_BYTES, headers: dict | None = None,
+                     timeout: float = 15) -> tuple[str, str]:
+    """
+    Async counterpart of ug_scraper.fetch_page, decoding the streamed page with
+    the same ug_scraper._PageReader. With CHORDBOT_STREAM_PAGES=0 the whole
+    page is read, as there.
+
+    Returns:
+        A (text, final url after redirects) tuple. The text may be truncated.
+
+    Raises:
+        httpx.HTTPError: On network errors or bad status codes.
+    """
+    limiter = ug_scraper._FETCH_LIMITER.get()
+    if limiter is not None:
+        await asyncio.to_thread(limiter.acquire, url)
+    logger.debug("Making async request to: %s with proxy: %s", url, ug_scraper.PA_PROXY is not None)
+    url = ug_scraper.upstream_url(url)
+    if not ug_scraper.STREAM_PAGES:
+        stop_at, max_bytes = None, float('inf')
+    client = get_client()
+    for attempt in range(ug_scraper.HTTP_RETRIES + 1):
+        async with client.stream('GET', url, headers=headers, timeout=timeout, follow_redirects=True) as response:
+            if response.status_code in RETRY_STATUSES and attempt < ug_scraper.HTTP_RETRIES:
+                await asyncio.sleep(_backoff(attempt))
+                continue
+            response.raise_for_status()
+            reader = ug_scraper._PageReader(url, ug_scraper._page_encoding(encoding, response.headers), stop_at,
+                                            max_bytes, response.headers.get('Content-Length'))
+            async for chunk in response.aiter_bytes(ug_scraper.STREAM_CHUNK_SIZE):
+                if reader.feed(chunk, response.num_bytes_downloaded):
+                    break
+            return reader.text(), str(response.url)
+
+
+# --- Providers ---
+# The providers are ug_scraper's steps (see ug_scraper.PageFetch); only the
+# fetching is async. Advancing the steps parses pages and reads the SQLite
+# search index, so that runs in a worker thread.
+
+async def _run_steps(steps) -> str | None:
+    """Async version of ug_scraper._run_steps."""
+    fetch, content = await asyncio.to_thread(ug_scraper._advance, steps)
+    while fetch is not None:
+        result, error = None, None
+        try:
+            with metrics.span(fetch.provider, fetch.stage):
+                result = await fetch_page(fetch.url, stop_at=fetch.stop_at, encoding=fetch.encoding,
+                                          headers=ug_scraper.HEADERS, timeout=fetch.timeout)
+        except httpx.HTTPError as e:
+            error = e
+        fetch, content = await asyncio.to_thread(ug_scraper._advance, steps, result, error)
+    return content
+
+
+async def _scrape(provider: str, query: str) -> str | None:
+    """
+    Async version of ug_scraper._scrape, for one of ug_scraper.PROVIDER_STEPS.
+
+    Raises:
+        ScraperError: If the song could not be scraped; the message says why.
+    """
+    try:
+        return await _run_steps(ug_scraper.PROVIDER_STEPS[provider](query))
+    except ScraperError:
+        raise
+    except httpx.HTTPError as e:
+        raise ug_scraper._scrape_error(provider, e, network=True, timed_out=isinstance(e, httpx.TimeoutException)) from e
+    except Exception as e:
+        raise ug_scraper._scrape_error(provider, e) from e
+
+
+# --- Combined Scraper ---
+
+# Providers in priority order, matching ug_scraper.PROVIDERS
+PROVIDERS = [(name, functools.partial(_scrape, name)) for name, _ in ug_scraper.PROVIDERS]
+
+
+async def _try_provider(name: str, scraper, query: str, on_progress=None) -> tuple[str | None, str | None, str]:
+    """
+    Async version of ug_scraper._try_provider. A provider task cancelled
+    because another one won is recorded as 'cancelled'.
+    """
+    error = ug_scraper._provider_starting(name, on_progress)
+    if error:
+        return None, error, 'skipped'
+    content, error, outcome = None, None, 'cancelled'
+    start = time.monotonic()
+    try:
+        with metrics.span(name, 'total'):
+            try:
+                content = await scraper(query)
+                outcome = 'hit' if content else 'miss'
+            except ScraperError as e:
+                error, outcome = str(e), e.outcome
+    finally:
+        ug_scraper._provider_finished(name, outcome, time.monotonic() - start, error, on_progress)
+    return content, error, outcome
+
+
+async def _run_sequential(query: str, providers: list, on_progress=None) -> tuple[str | None, str | None, str | None, str]:
+    """Async version of ug_scraper._run_sequential."""
+    errors, outcomes = [], []
+    for name, scraper in providers:
+        content, error, outcome = await _try_provider(name, scraper, query, on_progress)
+        if content:
+            logger.info("%s: Success!", name)
+            return content, name, None, 'hit'
+        logger.info("%s: Failed.", name)
+        outcomes.append(outcome)
+        if error:
+            errors.append(error)
+    return None, None, errors[0] if errors else None, ug_scraper._failed_outcome(outcomes)
+
+
+async def _run_concurrent(query: str, providers: list, hedge_delay: float,
+                          on_progress=None) -> tuple[str | None, str | None, str | None, str]:
+    """
+    Async version of ug_scraper._run_concurrent: same hedging and priority
+    rules, with the losing providers' tasks cancelled outright.
+    """
+    loop = asyncio.get_running_loop()
+    tasks = []
+    next_launch = loop.time()
+    try:
+        while True:
+            result = ug_scraper._settled(providers, tasks)
+            if result is not None:
+                return result
+
+            # Start the next provider if its hedge delay is up or everything before it failed
+            now = loop.time()
+            while len(tasks) < len(providers) and (now >= next_launch or all(t.done() for t in tasks)):
+                name, scraper = providers[len(tasks)]
+                tasks.append(asyncio.create_task(_try_provider(name, scraper, query, on_progress), name=f"provider-{name}"))
+                next_launch = now + hedge_delay
+
+            pending = [t for t in tasks if not t.done()]
+            timeout = max(0.0, next_launch - loop.time()) if len(tasks) < len(providers) else None
+            await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def _find_chords(query: str, mode: str | None = None, on_progress=None) -> tuple[str | None, str | None, str | None, str]:
+    """Async version of ug_scraper._find_chords."""
+    mode = mode or ug_scraper.PROVIDER_MODE
+    providers = ug_scraper.SCHEDULER.order(query, PROVIDERS)
+    if mode == 'sequential':
+        return await _run_sequential(query, providers, on_progress)
+    if mode == 'race':
+        return await _run_concurrent(query, providers, 0.0, on_progress)
+    if mode == 'hedged':
+        return await _run_concurrent(query, providers, ug_scraper.HEDGE_DELAY, on_progress)
+    raise ValueError(f"Unknown provider mode '{mode}', expected one of {ug_scraper.PROVIDER_MODES}")
+
+
+# In-flight lookups in this process, by normalized query
+_inflight = {}
+
+
+async def _scrape_and_cache(query: str, mode: str | None, on_progress=None) -> chord_cache.CacheEntry:
+    """
+    Async version of ug_scraper._scrape_and_cache, sharing its re-check and
+    storing rules (the lock file wait and cache calls run in threads).
+    """
+    lock = None
+    if ug_scraper.RESULT_CACHE.disk is not None:
+        lock = singleflight.FileLock(chord_cache.normalize_query(query))
+        if await asyncio.to_thread(lock.acquire, ug_scraper.LOCK_TIMEOUT):
+            entry = await asyncio.to_thread(ug_scraper._done_elsewhere, query)
+            if entry is not None:
+                lock.release()
+                return entry
+    try:
+        content, provider, error, outcome = await _find_chords(query, mode, on_progress)
+        return await asyncio.to_thread(ug_scraper._store_result, query, content, provider, error, outcome)
+    finally:
+        if lock is not None:
+            lock.release()
+
+
+async def _coalesced_scrape(query: str, mode: str | None, on_progress=None) -> chord_cache.CacheEntry:
+    """Scrapes `query`, or awaits the scrape already in flight for it on this event loop."""
+    key = chord_cache.normalize_query(query)
+    leader = _inflight.get(key)
+    if leader is not None:
+        try:
+            return await asyncio.wait_for(asyncio.shield(leader), ug_scraper.SINGLEFLIGHT_TIMEOUT)
+        except asyncio.TimeoutError:
+            return ug_scraper._waited_too_long(query)
+
+    future = _inflight[key] = asyncio.get_running_loop().create_future()
+    try:
+        entry = await _scrape_and_cache(query, mode, on_progress)
+        future.set_result(entry)
+        return entry
+    except Exception as e:
+        future.set_exception(e)
+        future.exception() # Mark as retrieved in case nobody else was waiting
+        raise
+    finally:
+        del _inflight[key]
+        if not future.done():
+            future.cancel()
+
+
+async def lookup_song_chords(query: str, mode: str | None = None, on_progress=None) -> chord_cache.CacheEntry:
+    """
+    Async version of ug_scraper.lookup_song_chords, sharing its result cache
+    and background refresher. Concurrent identical queries on this event loop
+    await a single scrape. `on_progress` is called on the event loop.
+    """
+    start = time.perf_counter()
+    entry = await asyncio.to_thread(ug_scraper._cached, query)
+    if entry is not None:
+        logger.debug("Cache hit for: %s (%s)", query, entry.provider or 'not found')
+        metrics.LOOKUP_SECONDS.observe(time.perf_counter() - start, source='stale' if entry.expired else 'cache')
+        return entry
+    entry = await _coalesced_scrape(query, mode, on_progress)
+    metrics.LOOKUP_SECONDS.observe(time.perf_counter() - start, source='scrape')
+    return entry
+
+
+async def get_song_chords(query: str, mode: str | None = None, transpose: int = 0, capo: int = 0) -> str:
+    """
+    Async version of ug_scraper.get_song_chords.
+
+    Args:
+        query: The song title and artist (e.g., "Wonderwall Oasis").
+        mode: 'sequential', 'race' or 'hedged'. Defaults to ug_scraper.PROVIDER_MODE.
+        transpose: Semitones to move the chords by.
+        capo: Capo fret; the chords are shown as the shapes to play with it.
+
+    Returns:
+        A multiline string containing the formatted chords and lyrics,
+        or an error message if the song is not found on any site or scraping fails.
+    """
+    entry = await lookup_song_chords(query, mode)
+    sheet = await asyncio.to_thread(ug_scraper.song_sheet, entry)
+    if sheet is not None:
+        return sheet.text(transpose, capo)
+    return ug_scraper.missing_message(query, entry)
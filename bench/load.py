@@ -0,0 +1,375 @@
+# End-to-end load test
+#
+# Starts app:app under gunicorn with the providers replaced by the stub server,
+# drives concurrent POST / and GET /api/chords traffic with a skewed mix of
+# repeat queries, and reports throughput, latency percentiles, error rate and
+# per-worker memory. Run from the repository root:
+#
+#   python -m bench.load --duration 30 --concurrency 16 --latency 150
+#   python -m bench.load --workers 2 --workers 4 --worker-class sync --worker-class gthread --threads 8
+#   python -m bench.load --json load.json --compare baseline.json   # exit 1 on throughput/p95 regressions
+#
+# Every --workers x --worker-class combination gets a fresh server and cache.
+import argparse
+import http.client
+import itertools
+import json
+import logging
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+from bench.stats import compare, percentiles
+from bench.stub_server import StubServer, add_profile_arguments, config_from_args
+
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Song queries the traffic is drawn from; --distinct extends them with numbered variants
+QUERIES = [
+    "Wonderwall Oasis", "De Musica Ligera Soda Stereo", "Garota de Ipanema Tom Jobim",
+    "Hotel California Eagles", "Persiana Americana Soda Stereo", "Aguas de Marco Elis Regina",
+    "Let It Be Beatles", "La Bamba Ritchie Valens", "Chega de Saudade Joao Gilberto",
+    "Hallelujah Leonard Cohen",
+]
+
+# Routes as named in the report
+ROUTE_POST_INDEX = 'POST /'
+ROUTE_GET_API = 'GET /api/chords'
+
+
+def query_pool(distinct: int) -> list:
+    """`distinct` different queries, the real-looking ones first."""
+    pool = list(QUERIES[:distinct])
+    for i in itertools.count(2):
+        if len(pool) >= distinct:
+            break
+        pool.extend(f"{query} live {i}" for query in QUERIES[:distinct - len(pool)])
+    return pool
+
+
+def zipf_weights(n: int, exponent: float) -> list:
+    """Popularity of the n queries: a few songs get most of the requests, like real traffic."""
+    return [1 / (rank ** exponent) for rank in range(1, n + 1)]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+# --- Server under test ---
+
+class AppServer:
+    """app:app under gunicorn in a subprocess, pointed at the stub providers."""
+
+    def __init__(self, upstream: str, workers: int, worker_class: str, threads: int,
+                 env: dict | None = None, log_path: str | None = None, gunicorn_args: list | None = None):
+        self.port = _free_port()
+        self._tmp = tempfile.mkdtemp(prefix='chordbot-load-')
+        self._env = {
+            **os.environ,
+            'CHORDBOT_UPSTREAM_OVERRIDE': upstream,
+            'CHORDBOT_CACHE_PATH': os.path.join(self._tmp, 'cache.sqlite3'),
+            'CHORDBOT_LOCK_DIR': os.path.join(self._tmp, 'locks'),
+            **(env or {}),
+        }
+        self._args = [
+            sys.executable, '-m', 'gunicorn', 'app:app',
+            '--bind', f'127.0.0.1:{self.port}',
+            '--workers', str(workers),
+            '--worker-class', worker_class,
+            '--threads', str(threads),
+            '--log-level', 'warning',
+            *(gunicorn_args or []),
+        ]
+        self._log_path = log_path
+        self._log = None
+        self.process = None
+
+    @property
+    def address(self) -> tuple[str, int]:
+        return '127.0.0.1', self.port
+
+    def start(self, timeout: float = 30) -> 'AppServer':
+        self._log = open(self._log_path, 'ab') if self._log_path else subprocess.DEVNULL
+        self.process = subprocess.Popen(self._args, cwd=ROOT, env=self._env, stdout=self._log, stderr=self._log)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"gunicorn exited with status {self.process.returncode}; see --server-log")
+            try:
+                conn = http.client.HTTPConnection(*self.address, timeout=2)
+                conn.request('GET', '/stats/cache')
+                if conn.getresponse().status == 200:
+                    conn.close()
+                    return self
+            except OSError:
+                pass
+            time.sleep(0.2)
+        self.stop()
+        raise RuntimeError(f"gunicorn did not answer within {timeout}s")
+
+    def worker_pids(self) -> list:
+        """PIDs of the gunicorn workers (children of the master)."""
+        pids = []
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    # The ppid is the 2nd field after the parenthesised command name
+                    ppid = int(f.read().rpartition(')')[2].split()[1])
+            except (OSError, ValueError, IndexError):
+                continue
+            if ppid == self.process.pid:
+                pids.append(int(entry))
+        return sorted(pids)
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        if self._log not in (None, subprocess.DEVNULL):
+            self._log.close()
+        shutil.rmtree(self._tmp, ignore_errors=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def process_memory(pid: int) -> dict:
+    """
+    RSS and PSS of a process in KiB. PSS splits shared (e.g. copy-on-write)
+    pages between the processes sharing them, so the workers' PSS adds up to
+    what they really cost. Linux only; empty elsewhere.
+    """
+    memory = {}
+    for path, fields in ((f'/proc/{pid}/status', {'VmRSS:': 'rss_kib', 'VmHWM:': 'peak_rss_kib'}),
+                         (f'/proc/{pid}/smaps_rollup', {'Pss:': 'pss_kib'})):
+        try:
+            with open(path) as f:
+                for line in f:
+                    parts = line.split()
+                    if parts and parts[0] in fields:
+                        memory[fields[parts[0]]] = int(parts[1])
+        except OSError:
+            pass
+    return memory
+
+
+class MemorySampler:
+    """Polls the workers' memory during the run and keeps each one's maximum."""
+
+    def __init__(self, server: AppServer, interval: float = 1.0):
+        self.server = server
+        self.interval = interval
+        self.peaks = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='memory-sampler', daemon=True)
+
+    def sample(self):
+        for pid in [self.server.process.pid] + self.server.worker_pids():
+            peak = self.peaks.setdefault(pid, {})
+            for name, value in process_memory(pid).items():
+                peak[name] = max(peak.get(name, 0), value)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+
+# --- Load generator ---
+
+class LoadResult:
+    def __init__(self):
+        self.latencies = {ROUTE_POST_INDEX: [], ROUTE_GET_API: []}
+        self.errors = {ROUTE_POST_INDEX: 0, ROUTE_GET_API: 0}
+        self.statuses = {}
+        self._lock = threading.Lock()
+
+    def add(self, route: str, seconds: float, status: int | None):
+        with self._lock:
+            self.latencies[route].append(seconds)
+            self.statuses[status or 'conn_error'] = self.statuses.get(status or 'conn_error', 0) + 1
+            if status is None or status >= 400:
+                self.errors[route] += 1
+
+
+def _client(address: tuple, deadline: float, queries: list, weights: list, post_ratio: float,
+            timeout: float, rng: random.Random, result: LoadResult | None):
+    """One keep-alive client sending requests back to back until `deadline`."""
+    conn = http.client.HTTPConnection(*address, timeout=timeout)
+    while time.monotonic() < deadline:
+        query = rng.choices(queries, weights)[0]
+        transpose = rng.choice((0, 0, 0, 2, -1))
+        if rng.random() < post_ratio:
+            route = ROUTE_POST_INDEX
+            body = urllib.parse.urlencode({'query': query, 'transpose': transpose, 'capo': 0})
+            args = ('POST', '/', body, {'Content-Type': 'application/x-www-form-urlencoded'})
+        else:
+            route = ROUTE_GET_API
+            path = '/api/chords?' + urllib.parse.urlencode({'q': query, 'transpose': transpose})
+            args = ('GET', path, None, {'Accept-Encoding': 'gzip'})
+        start = time.perf_counter()
+        try:
+            conn.request(*args)
+            response = conn.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            status = None
+            conn.close()
+            conn = http.client.HTTPConnection(*address, timeout=timeout)
+        if result is not None:
+            result.add(route, time.perf_counter() - start, status)
+    conn.close()
+
+
+def drive(address: tuple, concurrency: int, duration: float, queries: list, weights: list,
+          post_ratio: float, timeout: float, seed: int, record: bool = True) -> LoadResult | None:
+    """Runs `concurrency` clients for `duration` seconds."""
+    result = LoadResult() if record else None
+    deadline = time.monotonic() + duration
+    threads = [
+        threading.Thread(target=_client, name=f'client-{i}', daemon=True,
+                         args=(address, deadline, queries, weights, post_ratio, timeout, random.Random(seed + i), result))
+        for i in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return result
+
+
+def run_scenario(args, upstream: str, workers: int, worker_class: str) -> dict:
+    """One server configuration: warm-up, measured run, memory. Returns its results."""
+    name = f"load/{worker_class}x{workers}"
+    env = dict(value.split('=', 1) for value in args.env)
+    queries = query_pool(args.distinct)
+    weights = zipf_weights(len(queries), args.zipf)
+    with AppServer(upstream, workers, worker_class, args.threads, env, args.server_log, args.gunicorn_arg) as server:
+        if args.warmup > 0:
+            drive(server.address, args.concurrency, args.warmup, queries, weights, args.post_ratio,
+                  args.timeout, args.seed, record=False)
+        with MemorySampler(server) as sampler:
+            start = time.monotonic()
+            result = drive(server.address, args.concurrency, args.duration, queries, weights,
+                           args.post_ratio, args.timeout, args.seed + 1000)
+            elapsed = time.monotonic() - start
+        master = server.process.pid
+
+    all_latencies = [s for samples in result.latencies.values() for s in samples]
+    total_errors = sum(result.errors.values())
+    results = {
+        name: {
+            **percentiles(all_latencies),
+            'rps': len(all_latencies) / elapsed if elapsed else 0.0,
+            'error_rate': total_errors / len(all_latencies) if all_latencies else 0.0,
+            'statuses': {str(status): count for status, count in sorted(result.statuses.items(), key=str)},
+        },
+    }
+    for route, samples in result.latencies.items():
+        results[f"{name}/{route}"] = {
+            **percentiles(samples),
+            'rps': len(samples) / elapsed if elapsed else 0.0,
+            'error_rate': result.errors[route] / len(samples) if samples else 0.0,
+        }
+    workers_memory = {pid: memory for pid, memory in sampler.peaks.items() if pid != master}
+    results[f"{name}/memory"] = {
+        'master': sampler.peaks.get(master, {}),
+        'workers': list(workers_memory.values()),
+        'total_pss_kib': sum(memory.get('pss_kib', 0) for memory in sampler.peaks.values()),
+    }
+    return results
+
+
+def print_report(results: dict):
+    print(f"{'scenario':<44}{'n':>7}{'req/s':>9}{'err %':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for name, r in results.items():
+        if name.endswith('/memory'):
+            workers = r['workers']
+            rss = [w.get('rss_kib', 0) for w in workers]
+            pss = [w.get('pss_kib', 0) for w in workers]
+            print(f"  memory: {len(workers)} workers, max RSS {max(rss, default=0)} KiB,"
+                  f" max PSS {max(pss, default=0)} KiB, total PSS incl. master {r['total_pss_kib']} KiB")
+            continue
+        print(f"{name:<44}{r.get('n', 0):>7}{r.get('rps', 0):>9.1f}{r.get('error_rate', 0) * 100:>7.2f}"
+              f"{r.get('p50', 0):>9.1f}{r.get('p95', 0):>9.1f}{r.get('p99', 0):>9.1f}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Load test app:app under gunicorn against stub providers.')
+    parser.add_argument('--workers', type=int, action='append', help='gunicorn worker count(s) (default: 2)')
+    parser.add_argument('--worker-class', action='append', help='gunicorn worker class(es) (default: sync)')
+    parser.add_argument('--threads', type=int, default=1, help='Threads per worker, for gthread (default: 1)')
+    parser.add_argument('--gunicorn-arg', action='append', default=[], help='Extra gunicorn argument (repeatable)')
+    parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE',
+                        help='Extra environment for the app, e.g. CHORDBOT_PROVIDER_MODE=hedged (repeatable)')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients (default: 8)')
+    parser.add_argument('--duration', type=float, default=20, help='Measured seconds per scenario (default: 20)')
+    parser.add_argument('--warmup', type=float, default=3, help='Unmeasured seconds before each run (default: 3)')
+    parser.add_argument('--post-ratio', type=float, default=0.5, help='Fraction of POST / vs GET /api/chords (default: 0.5)')
+    parser.add_argument('--distinct', type=int, default=50, help='Number of different songs queried (default: 50)')
+    parser.add_argument('--zipf', type=float, default=1.1, help='Skew of the query popularity; 0 is uniform (default: 1.1)')
+    parser.add_argument('--timeout', type=float, default=60, help='Client timeout per request in seconds')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--server-log', metavar='PATH', help='Append gunicorn output to this file')
+    parser.add_argument('--json', metavar='PATH', help='Also write the results as JSON')
+    parser.add_argument('--compare', metavar='PATH', help='Baseline JSON to check for throughput/p95 regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown vs the baseline (default: 0.25)')
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    for value in args.env:
+        if '=' not in value:
+            parser.error(f"--env expects NAME=VALUE, got '{value}'")
+
+    results = {}
+    with StubServer(config_from_args(args)) as stub:
+        for worker_class in args.worker_class or ['sync']:
+            for workers in args.workers or [2]:
+                results.update(run_scenario(args, stub.url, workers, worker_class))
+
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,150 @@
+# Offline scraper benchmark
+#
+# Replays the synthetic pages in bench/fixtures/ (see bench/stub_server.py)
+# through a local stub server and reports latency percentiles per provider and
+# end to end, plus parse CPU time and memory, without touching the real sites.
+# The numbers are for comparing revisions of this code, not predictions of
+# production latency. Run from the repository root:
+#
+#   python -m bench.run --iterations 50 --latency 40 --json bench.json
+#   python -m bench.run --host-miss-rate www.ultimate-guitar.com=1   # exercise the fallbacks
+#   python -m bench.run --compare baseline.json --tolerance 0.25      # exit 1 on p95 regressions
+import argparse
+import json
+import logging
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+# The benchmark measures scraping, so keep the result cache and search index out of the picture
+os.environ.setdefault('CHORDBOT_CACHE_PATH', '')
+os.environ.setdefault('CHORDBOT_INDEX_TTL', '0')
+
+import ug_scraper
+from bench.stats import compare, percentiles
+from bench.stub_server import FIXTURES_DIR, StubServer, add_profile_arguments, config_from_args
+
+QUERIES = ["Wonderwall Oasis", "De Musica Ligera Soda Stereo", "Garota de Ipanema Tom Jobim"]
+
+
+def _read_fixture(name: str, encoding: str = 'utf-8') -> str:
+    with open(os.path.join(FIXTURES_DIR, name), encoding=encoding) as f:
+        return f.read()
+
+
+def bench_parsing(iterations: int) -> dict:
+    """CPU time and peak memory of each provider's parse step on the full fixtures."""
+    ug_search = _read_fixture('ug_search.html')
+    ug_tab = _read_fixture('ug_tab.html')
+    lacuerda_search = _read_fixture('lacuerda_search.html', 'iso-8859-1')
+    lacuerda_song = _read_fixture('lacuerda_song.html', 'iso-8859-1')
+    cifraclub_search = _read_fixture('cifraclub_search.html')
+    cifraclub_song = _read_fixture('cifraclub_song.html')
+    stages = {
+        'parse/ug/search': lambda: ug_scraper._ug_tab_url(ug_search, QUERIES[0]),
+        'parse/ug/tab': lambda: ug_scraper._ug_format(ug_tab),
+        'parse/lacuerda/search': lambda: ug_scraper._lacuerda_song_url(lacuerda_search),
+        'parse/lacuerda/song': lambda: ug_scraper._lacuerda_format(lacuerda_song),
+        'parse/cifraclub/search': lambda: ug_scraper._cifraclub_parse_search(cifraclub_search, 'https://www.cifraclub.com/find/'),
+        'parse/cifraclub/song': lambda: ug_scraper._cifraclub_format(cifraclub_song),
+    }
+    results = {}
+    for name, stage in stages.items():
+        tracemalloc.start()
+        stage()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        cpu_times = []
+        for _ in range(iterations):
+            start = time.process_time()
+            stage()
+            cpu_times.append(time.process_time() - start)
+        results[name] = {**percentiles(cpu_times), 'peak_kib': peak / 1024}
+    return results
+
+
+def bench_providers(iterations: int) -> dict:
+    """Wall-clock latency of each provider scraper against the stub server."""
+    results = {}
+    for name, scraper in ug_scraper.PROVIDERS:
+        latencies = []
+        failures = 0
+        for i in range(iterations):
+            start = time.perf_counter()
+            content, _, _ = ug_scraper._try_provider(name, scraper, QUERIES[i % len(QUERIES)], None)
+            latencies.append(time.perf_counter() - start)
+            failures += not content
+        results[f'provider/{name}'] = {**percentiles(latencies), 'failures': failures}
+    return results
+
+
+def bench_end_to_end(iterations: int, modes: list) -> dict:
+    """Latency of the whole provider chain (no result cache) per provider mode."""
+    results = {}
+    for mode in modes:
+        latencies = []
+        winners = {}
+        for i in range(iterations):
+            start = time.perf_counter()
+            _, provider, _, _ = ug_scraper._find_chords(QUERIES[i % len(QUERIES)], mode)
+            latencies.append(time.perf_counter() - start)
+            winners[provider or 'none'] = winners.get(provider or 'none', 0) + 1
+        results[f'e2e/{mode}'] = {**percentiles(latencies), 'winners': winners}
+    return results
+
+
+def print_report(results: dict):
+    print(f"{'benchmark':<34}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  extra")
+    for name, r in results.items():
+        if name == 'process':
+            continue
+        extra = {k: v for k, v in r.items() if k not in ('n', 'p50', 'p95', 'p99', 'mean', 'max')}
+        if 'peak_kib' in extra:
+            extra['peak_kib'] = round(extra['peak_kib'], 1)
+        print(f"{name:<34}{r.get('n', 0):>6}{r.get('p50', 0):>10.2f}{r.get('p95', 0):>10.2f}{r.get('p99', 0):>10.2f}  {extra or ''}")
+    print(f"max RSS: {results['process']['max_rss_kib']} KiB")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Offline benchmark of the chord scrapers.')
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--mode', action='append', choices=ug_scraper.PROVIDER_MODES,
+                        help='Provider mode(s) for the end-to-end run (default: all)')
+    parser.add_argument('--skip', action='append', default=[], choices=('parse', 'providers', 'e2e'))
+    parser.add_argument('--json', metavar='PATH', help='Also write the results as JSON')
+    parser.add_argument('--compare', metavar='PATH', help='Baseline JSON to check for p95 regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed p95 slowdown vs the baseline (default: 0.25)')
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    results = {}
+    if 'parse' not in args.skip:
+        results.update(bench_parsing(args.iterations))
+    with StubServer(config_from_args(args)) as server:
+        ug_scraper.UPSTREAM_OVERRIDE = server.url
+        ug_scraper.close_sessions()
+        if 'providers' not in args.skip:
+            results.update(bench_providers(args.iterations))
+        if 'e2e' not in args.skip:
+            results.update(bench_end_to_end(args.iterations, args.mode or list(ug_scraper.PROVIDER_MODES)))
+        ug_scraper.close_sessions()
+    results['process'] = {'max_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
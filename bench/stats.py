@@ -0,0 +1,37 @@
+# Latency summaries and baseline comparison shared by the bench CLIs
+
+
+def percentiles(samples: list) -> dict:
+    """p50/p95/p99/mean/max of a list of seconds, in milliseconds."""
+    if not samples:
+        return {'n': 0}
+    ordered = sorted(samples)
+
+    def pick(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] * 1000
+
+    return {
+        'n': len(ordered),
+        'p50': pick(50),
+        'p95': pick(95),
+        'p99': pick(99),
+        'mean': sum(ordered) / len(ordered) * 1000,
+        'max': ordered[-1] * 1000,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Descriptions of benchmarks whose p95 got more than `tolerance` slower, or
+    whose throughput (rps) dropped by more than `tolerance`, vs the baseline.
+    """
+    regressions = []
+    for name, base in baseline.items():
+        current = results.get(name)
+        if not isinstance(current, dict) or not isinstance(base, dict):
+            continue
+        if base.get('p95') and 'p95' in current and current['p95'] > base['p95'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {current['p95']:.2f} ms vs baseline {base['p95']:.2f} ms")
+        if base.get('rps') and 'rps' in current and current['rps'] < base['rps'] * (1 - tolerance):
+            regressions.append(f"{name}: {current['rps']:.1f} req/s vs baseline {base['rps']:.1f} req/s")
+    return regressions
@@ -0,0 +1,198 @@
+# Local stand-in for the provider sites
+#
+# Serves the pages in bench/fixtures/ with injectable latency and failures.
+# They are synthetic, not captures of the real sites: each one carries just the
+# markup its parser reads (UG's js-store JSON, LaCuerda's result links and
+# <pre id="tab_content">, CifraClub's result links and <pre>), padded with
+# filler rows and script to roughly the size of a real page, so fetch and parse
+# costs are in the right range. They won't catch a change in the real markup.
+#
+# Point the scrapers at it with ug_scraper.UPSTREAM_OVERRIDE (or the
+# CHORDBOT_UPSTREAM_OVERRIDE env var): requests then arrive as
+# /<original host>/<original path>, e.g. /lacuerda.net/BUSCADOR/index.php.
+import argparse
+import logging
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# (host, path prefix, fixture file, content type). The first match wins.
+ROUTES = [
+    ('www.ultimate-guitar.com', '/search.php', 'ug_search.html', 'text/html; charset=utf-8'),
+    ('tabs.ultimate-guitar.com', '/', 'ug_tab.html', 'text/html; charset=utf-8'),
+    ('lacuerda.net', '/BUSCADOR/', 'lacuerda_search.html', 'text/html'),
+    ('lacuerda.net', '/tabs/', 'lacuerda_song.html', 'text/html'),
+    ('www.cifraclub.com', '/find/', 'cifraclub_search.html', 'text/html; charset=utf-8'),
+    ('www.cifraclub.com', '/', 'cifraclub_song.html', 'text/html; charset=utf-8'),
+]
+
+# Served instead of a fixture to simulate "song not found"
+MISS_PAGE = b'<html><body><p>No results.</p></body></html>\n'
+
+
+class HostProfile:
+    """Latency and failure injection for one upstream host."""
+
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0, error_rate: float = 0,
+                 miss_rate: float = 0, hang_rate: float = 0, hang_seconds: float = 30):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.miss_rate = miss_rate
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+
+    def copy(self) -> 'HostProfile':
+        return HostProfile(**vars(self))
+
+
+class StubConfig:
+    """Default profile plus per-host overrides; shared with the request handlers."""
+
+    def __init__(self, default: HostProfile | None = None):
+        self.default = default or HostProfile()
+        self.hosts = {}
+
+    def profile(self, host: str) -> HostProfile:
+        return self.hosts.get(host, self.default)
+
+    def set(self, host: str, **settings):
+        profile = self.hosts.get(host) or self.default.copy()
+        for name, value in settings.items():
+            setattr(profile, name, value)
+        self.hosts[host] = profile
+
+
+def _load_fixtures() -> dict:
+    fixtures = {}
+    for _, _, name, _ in ROUTES:
+        with open(os.path.join(FIXTURES_DIR, name), 'rb') as f:
+            fixtures[name] = f.read()
+    return fixtures
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # Keep-alive, like the real sites
+
+    def do_GET(self):
+        host, _, path = self.path.lstrip('/').partition('/')
+        path = '/' + path
+        route = next((r for r in ROUTES if r[0] == host and path.startswith(r[1])), None)
+        if route is None:
+            self._send(404, b'Not found\n', 'text/plain')
+            return
+
+        profile = self.server.config.profile(host)
+        delay = profile.latency_ms + random.uniform(-profile.jitter_ms, profile.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+        roll = random.random()
+        if roll < profile.hang_rate:
+            time.sleep(profile.hang_seconds)
+        elif roll < profile.hang_rate + profile.error_rate:
+            self._send(503, b'Service Unavailable\n', 'text/plain')
+        elif roll < profile.hang_rate + profile.error_rate + profile.miss_rate:
+            self._send(200, MISS_PAGE, 'text/html; charset=utf-8')
+        else:
+            self._send(200, self.server.fixtures[route[2]], route[3])
+
+    def _send(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass # The scraper stopped reading early
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+class StubServer:
+    """Runs the stand-in server on a background thread."""
+
+    def __init__(self, config: StubConfig | None = None, host: str = '127.0.0.1', port: int = 0):
+        self.config = config or StubConfig()
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.config = self.config
+        self._httpd.fixtures = _load_fixtures()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'StubServer':
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='stub-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        """Serves on the calling thread until interrupted."""
+        self._httpd.serve_forever()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _host_setting(value: str) -> tuple[str, float]:
+    host, _, number = value.partition('=')
+    if not host or not number:
+        raise argparse.ArgumentTypeError(f"expected HOST=VALUE, got '{value}'")
+    return host, float(number)
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser):
+    """Adds the latency/failure injection options shared by the bench CLIs."""
+    parser.add_argument('--latency', type=float, default=0, help='Added latency per response in ms (default: 0)')
+    parser.add_argument('--jitter', type=float, default=0, help='Random +/- jitter on the latency in ms')
+    parser.add_argument('--error-rate', type=float, default=0, help='Fraction of responses that are 503s')
+    parser.add_argument('--miss-rate', type=float, default=0, help='Fraction of responses without the song')
+    parser.add_argument('--hang-rate', type=float, default=0, help='Fraction of responses that hang for --hang-seconds')
+    parser.add_argument('--hang-seconds', type=float, default=30)
+    for name in ('latency', 'error-rate', 'miss-rate', 'hang-rate'):
+        parser.add_argument(f'--host-{name}', type=_host_setting, action='append', default=[], metavar='HOST=VALUE',
+                            help=f'Per-host --{name}, e.g. www.ultimate-guitar.com=0.5 (repeatable)')
+
+
+def config_from_args(args: argparse.Namespace) -> StubConfig:
+    config = StubConfig(HostProfile(
+        latency_ms=args.latency, jitter_ms=args.jitter, error_rate=args.error_rate,
+        miss_rate=args.miss_rate, hang_rate=args.hang_rate, hang_seconds=args.hang_seconds,
+    ))
+    for option, attribute in (('host_latency', 'latency_ms'), ('host_error_rate', 'error_rate'),
+                              ('host_miss_rate', 'miss_rate'), ('host_hang_rate', 'hang_rate')):
+        for host, value in getattr(args, option):
+            config.set(host, **{attribute: value})
+    return config
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve synthetic provider pages locally.')
+    parser.add_argument('--port', type=int, default=8765)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    server = StubServer(config_from_args(args), port=args.port)
+    print(f"Stub providers on {server.url} - set CHORDBOT_UPSTREAM_OVERRIDE={server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
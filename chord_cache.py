@@ -0,0 +1,361 @@
+# Result cache for get_song_chords
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# TTLs are in seconds. A TTL of 0 disables caching for that kind of result.
+CACHE_TTL = int(os.environ.get('CHORDBOT_CACHE_TTL', str(7 * 24 * 3600)))
+# Not-found results: a plain miss is kept for the negative TTL, while lookups
+# that failed because a provider timed out or errored get the much shorter
+# error TTL, so an upstream hiccup doesn't hide a song for ten minutes.
+CACHE_NEGATIVE_TTL = int(os.environ.get('CHORDBOT_CACHE_NEGATIVE_TTL', '600'))
+CACHE_ERROR_TTL = int(os.environ.get('CHORDBOT_CACHE_ERROR_TTL', '30'))
+# How long past its TTL a found result is kept so it can be served stale while
+# it is refreshed in the background (see refresher.py). 0 disables stale reads.
+CACHE_STALE_TTL = int(os.environ.get('CHORDBOT_CACHE_STALE_TTL', str(7 * 24 * 3600)))
+CACHE_MEMORY_SIZE = int(os.environ.get('CHORDBOT_CACHE_MEMORY_SIZE', '256'))
+# Shared by all gunicorn workers; set to an empty string to keep the cache in memory only
+CACHE_PATH = os.environ.get('CHORDBOT_CACHE_PATH', 'chordbot_cache.sqlite3')
+CACHE_DISK_MAX_ROWS = int(os.environ.get('CHORDBOT_CACHE_DISK_MAX_ROWS', '20000'))
+
+
+def normalize_query(query: str) -> str:
+    """
+    Builds the cache key for a query: accents stripped, case folded and
+    whitespace collapsed, so "  Música Ligera" and "musica ligera" share a key.
+    """
+    decomposed = unicodedata.normalize('NFKD', query)
+    without_accents = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return ' '.join(without_accents.casefold().split())
+
+
+class CacheEntry(NamedTuple):
+    """
+    A cached get_song_chords outcome. `content` is None for "not found" results.
+
+    `outcome` says how the lookup ended: 'hit', 'miss' (no provider has the
+    song), or 'timeout' / 'error' when a provider failed to answer.
+    """
+    content: str | None
+    provider: str | None
+    error: str | None
+    expires_at: float
+    outcome: str | None = None
+
+    @property
+    def found(self) -> bool:
+        return self.content is not None
+
+    @property
+    def expired(self) -> bool:
+        return time.time() >= self.expires_at
+
+    def usable(self, allow_stale: bool, stale_ttl: float) -> bool:
+        """Whether the entry can be served: fresh, or found and within `stale_ttl` of expiring."""
+        if not self.expired:
+            return True
+        return allow_stale and self.found and time.time() < self.expires_at + stale_ttl
+
+    def removable(self, stale_ttl: float) -> bool:
+        """Whether the entry can no longer be served, even stale."""
+        return self.expired and not self.usable(True, stale_ttl)
+
+
+class MemoryCache:
+    """Thread-safe bounded LRU of CacheEntry objects."""
+
+    def __init__(self, max_size: int, stale_ttl: float = 0):
+        self.max_size = max_size
+        self.stale_ttl = stale_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str, allow_stale: bool = False) -> CacheEntry | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not entry.usable(allow_stale, self.stale_ttl):
+                if entry is not None and entry.removable(self.stale_ttl):
+                    del self._entries[key]
+                    self.evictions += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: str, entry: CacheEntry):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DiskCache:
+    """
+    SQLite-backed cache shared between processes and kept across restarts.
+
+    Each thread gets its own connection, since sqlite3 connections can't be
+    shared between threads. WAL mode lets workers read while one writes.
+    """
+
+    # Prune expired and excess rows once every this many writes
+    PRUNE_EVERY = 200
+
+    def __init__(self, path: str, max_rows: int, stale_ttl: float = 0):
+        self.path = path
+        self.max_rows = max_rows
+        self.stale_ttl = stale_ttl
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        conn = self._connect()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS results ('
+            ' key TEXT PRIMARY KEY,'
+            ' content TEXT,'
+            ' provider TEXT,'
+            ' error TEXT,'
+            ' created_at REAL NOT NULL,'
+            ' expires_at REAL NOT NULL,'
+            ' outcome TEXT)'
+        )
+        # Caches written before outcomes were stored
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(results)')}
+        if 'outcome' not in columns:
+            try:
+                conn.execute('ALTER TABLE results ADD COLUMN outcome TEXT')
+            except sqlite3.OperationalError:
+                pass # Another worker added it first
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str, allow_stale: bool = False) -> CacheEntry | None:
+        row = self._connect().execute(
+            'SELECT content, provider, error, expires_at, outcome FROM results WHERE key = ?', (key,)
+        ).fetchone()
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            entry = CacheEntry(*row)
+            if not entry.usable(allow_stale, self.stale_ttl):
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry
+
+    def put(self, key: str, entry: CacheEntry):
+        conn = self._connect()
+        conn.execute(
+            'INSERT OR REPLACE INTO results (key, content, provider, error, created_at, expires_at, outcome)'
+            ' VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (key, entry.content, entry.provider, entry.error, time.time(), entry.expires_at, entry.outcome),
+        )
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % self.PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+
+    def prune(self):
+        """Deletes rows that can't be served even stale, then the oldest rows beyond max_rows."""
+        conn = self._connect()
+        now = time.time()
+        removed = conn.execute(
+            'DELETE FROM results WHERE expires_at <= ? OR (content IS NULL AND expires_at <= ?)',
+            (now - self.stale_ttl, now),
+        ).rowcount
+        removed += conn.execute(
+            'DELETE FROM results WHERE key IN ('
+            ' SELECT key FROM results ORDER BY created_at DESC LIMIT -1 OFFSET ?)',
+            (self.max_rows,),
+        ).rowcount
+        with self._lock:
+            self.evictions += removed
+
+    def recent(self, limit: int) -> list:
+        """The `limit` most recently written fresh found entries, newest first, as (key, entry) pairs."""
+        rows = self._connect().execute(
+            'SELECT key, content, provider, error, expires_at, outcome FROM results'
+            ' WHERE content IS NOT NULL AND expires_at > ? ORDER BY created_at DESC LIMIT ?',
+            (time.time(), limit),
+        ).fetchall()
+        return [(key, CacheEntry(*entry)) for key, *entry in rows]
+
+    def clear(self):
+        self._connect().execute('DELETE FROM results')
+
+    def close(self):
+        """Closes this thread's connection (the next call reopens it)."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def after_fork(self):
+        """
+        Drops connections inherited from the parent process without using
+        them; a SQLite connection must not be carried across fork().
+        """
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+
+class ChordCache:
+    """
+    Two-tier cache: a per-process LRU in front of an optional SQLite store.
+
+    Disk hits are copied into the LRU so the next lookup stays in memory.
+    Found results stay readable for `stale_ttl` seconds after they expire,
+    for callers that pass allow_stale and refresh them in the background.
+    """
+
+    def __init__(self, ttl: int = CACHE_TTL, negative_ttl: int = CACHE_NEGATIVE_TTL,
+                 memory_size: int = CACHE_MEMORY_SIZE, path: str | None = CACHE_PATH,
+                 disk_max_rows: int = CACHE_DISK_MAX_ROWS, stale_ttl: int = CACHE_STALE_TTL,
+                 error_ttl: int = CACHE_ERROR_TTL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.error_ttl = error_ttl
+        self.stale_ttl = stale_ttl
+        self.memory = MemoryCache(memory_size, stale_ttl)
+        self.disk = None
+        if path:
+            try:
+                self.disk = DiskCache(path, disk_max_rows, stale_ttl)
+            except sqlite3.Error as e:
+                logger.warning("Cache: Could not open %s, using memory only: %s", path, e)
+
+    def get(self, query: str, allow_stale: bool = False) -> CacheEntry | None:
+        """
+        Returns the fresh entry for `query`, or None on a miss. With
+        allow_stale, an expired found entry is returned too (check entry.expired).
+        """
+        key = normalize_query(query)
+        entry = self.memory.get(key, allow_stale)
+        if entry is not None or self.disk is None:
+            return entry
+        try:
+            entry = self.disk.get(key, allow_stale)
+        except sqlite3.Error as e:
+            logger.warning("Cache: Disk read failed: %s", e)
+            return None
+        if entry is not None:
+            self.memory.put(key, entry)
+        return entry
+
+    def get_shared(self, query: str, allow_stale: bool = False) -> CacheEntry | None:
+        """
+        Like get, but reads the shared disk tier even when this process has the
+        query in memory, so a result another worker wrote since replaces the
+        older local copy. Used to decide whether a refresh is still needed.
+        """
+        if self.disk is None:
+            return self.get(query, allow_stale)
+        key = normalize_query(query)
+        try:
+            entry = self.disk.get(key, allow_stale)
+        except sqlite3.Error as e:
+            logger.warning("Cache: Disk read failed: %s", e)
+            return self.memory.get(key, allow_stale)
+        if entry is not None:
+            self.memory.put(key, entry)
+        return entry
+
+    def put(self, query: str, content: str | None, provider: str | None, error: str | None,
+            outcome: str | None = None) -> CacheEntry:
+        """
+        Stores a result and returns the entry. Found results get the TTL, plain
+        misses the negative TTL and failed lookups ('timeout' or 'error') the
+        error TTL. `outcome` defaults to 'hit' or 'miss' depending on `content`.
+        """
+        outcome = outcome or ('hit' if content is not None else 'miss')
+        if content is not None:
+            ttl = self.ttl
+        else:
+            ttl = self.negative_ttl if outcome == 'miss' else self.error_ttl
+        entry = CacheEntry(content, provider, error, time.time() + ttl, outcome)
+        if ttl <= 0:
+            return entry
+        key = normalize_query(query)
+        self.memory.put(key, entry)
+        if self.disk is not None:
+            try:
+                self.disk.put(key, entry)
+            except sqlite3.Error as e:
+                logger.warning("Cache: Disk write failed: %s", e)
+        return entry
+
+    def warm(self, limit: int) -> list:
+        """
+        Copies up to `limit` of the newest found disk entries into the memory
+        tier, e.g. before forking workers. Returns the entries copied.
+        """
+        if self.disk is None or limit <= 0:
+            return []
+        try:
+            rows = self.disk.recent(limit)
+        except sqlite3.Error as e:
+            logger.warning("Cache: Could not read entries to warm up: %s", e)
+            return []
+        # Oldest first, so the newest end up most recently used
+        for key, entry in reversed(rows):
+            self.memory.put(key, entry)
+        return [entry for _, entry in rows]
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> dict:
+        """Hit, miss and eviction counters for this process."""
+        stats = {
+            'memory': {
+                'size': len(self.memory),
+                'max_size': self.memory.max_size,
+                'hits': self.memory.hits,
+                'misses': self.memory.misses,
+                'evictions': self.memory.evictions,
+            },
+        }
+        if self.disk is not None:
+            stats['disk'] = {
+                'path': self.disk.path,
+                'hits': self.disk.hits,
+                'misses': self.disk.misses,
+                'evictions': self.disk.evictions,
+            }
+        return stats
@@ -0,0 +1,234 @@
+# Structured chord sheets
+#
+# Parses provider output (UG's [ch]...[/ch] markup or the plain chords-over-
+# lyrics text from LaCuerda and CifraClub) into lines with chord positions, so
+# transposed and capo views can be rendered without scraping again.
+import functools
+import html
+import os
+import re
+import threading
+from typing import NamedTuple
+
+# Parsed sheets kept in memory, keyed by the provider content
+SHEET_CACHE_SIZE = int(os.environ.get('CHORDBOT_SHEET_CACHE_SIZE', '256'))
+
+_SHARPS = ('C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B')
+_FLATS = ('C', 'Db', 'D', 'Eb', 'E', 'F', 'Gb', 'G', 'Ab', 'A', 'Bb', 'B')
+_SEMITONES = {name: i for names in (_SHARPS, _FLATS) for i, name in enumerate(names)}
+_SEMITONES.update({'Cb': 11, 'Fb': 4, 'E#': 5, 'B#': 0})
+# Keys conventionally written with flats (majors, then minors by their root)
+_FLAT_MAJOR_KEYS = {'F', 'Bb', 'Eb', 'Ab', 'Db', 'Gb'}
+_FLAT_MINOR_KEYS = {'D', 'G', 'C', 'F', 'Bb', 'Eb'}
+
+# Root, quality/extensions and optional bass note, e.g. "C#m7(b5)/G"
+_CHORD = re.compile(
+    r'(?P<root>[A-G][#b]?)'
+    r'(?P<suffix>(?:maj|min|m|M|dim|aug|sus|add|\+|°|º|-)?'
+    r'(?:(?:maj|M|sus|add|dim|aug|b|#|\+|-)?\d+)*'
+    r'(?:\([^)\s]*\))?)'
+    r'(?:/(?P<bass>[A-G][#b]?))?$'
+)
+_TOKEN = re.compile(r'\S+')
+_UG_CHORD = re.compile(r'\[ch\](.*?)\[/ch\]')
+_UG_TAB_TAG = re.compile(r'\[/?tab\]')
+# Non-chord tokens allowed on a chord line: bar lines, repeats, labels like "Intro:"
+_DECORATION = re.compile(r'^(?:[|/%*.:-]+|\(?x\d+\)?|\d+x|\(|\)|[^\W\d_][\w-]*:)$', re.IGNORECASE)
+_SECTION = re.compile(
+    r'^\s*(?:\[(?P<tag>[^\]\[]{1,40})\]'
+    r'|(?P<label>(?:intro|verse|verso|estrofa|chorus|coro|estribillo|refrão|refrao|pre-?chorus|pre-?coro'
+    r'|bridge|puente|ponte|solo|outro|final|interlude|interludio|instrumental)\b[^:]{0,20}):?)\s*$',
+    re.IGNORECASE,
+)
+_TAB_LINE = re.compile(r'^\s*[A-Ga-g]?[#b]?\s*\|[-0-9hpbrsx/\\~|*() ]{4,}$')
+
+
+def _chord_parts(name: str) -> tuple | None:
+    match = _CHORD.match(name)
+    if not match:
+        return None
+    return match.group('root'), match.group('suffix'), match.group('bass')
+
+
+def is_chord(token: str) -> bool:
+    return _CHORD.match(token) is not None
+
+
+@functools.lru_cache(maxsize=4096)
+def transpose_chord(name: str, semitones: int, flats: bool = False) -> str:
+    """Moves a chord name by `semitones`, spelling accidentals as flats or sharps. Unknown names are kept."""
+    parts = _chord_parts(name)
+    if parts is None or semitones % 12 == 0:
+        return name
+    root, suffix, bass = parts
+    names = _FLATS if flats else _SHARPS
+    new = names[(_SEMITONES[root] + semitones) % 12] + suffix
+    if bass:
+        new += '/' + names[(_SEMITONES[bass] + semitones) % 12]
+    return new
+
+
+class Line(NamedTuple):
+    """
+    One line of a sheet. `kind` is 'chords', 'lyrics', 'section', 'tab' or
+    'blank'; `chords` holds (column, chord name) pairs found in `text`.
+    """
+    kind: str
+    text: str
+    chords: tuple = ()
+
+
+def _classify(text: str, chords: tuple) -> str:
+    if not text.strip():
+        return 'blank'
+    if _SECTION.match(text) and not chords:
+        return 'section'
+    if _TAB_LINE.match(text):
+        return 'tab'
+    if chords:
+        chord_columns = {column for column, _ in chords}
+        others = [m.group() for m in _TOKEN.finditer(text) if m.start() not in chord_columns]
+        if all(_DECORATION.match(token) for token in others):
+            return 'chords'
+    return 'lyrics'
+
+
+def _parse_markup_line(raw: str) -> Line:
+    """A line of UG text: chords are the [ch] spans, wherever they are."""
+    text = ''
+    chords = []
+    pos = 0
+    for match in _UG_CHORD.finditer(raw):
+        text += raw[pos:match.start()]
+        name = match.group(1).strip()
+        chords.append((len(text), name))
+        text += name
+        pos = match.end()
+    text += raw[pos:]
+    chords = tuple(chords)
+    return Line(_classify(text, chords), text, chords)
+
+
+def _parse_plain_line(text: str) -> Line:
+    """A line of plain text: chords are only recognised on lines made of chord names."""
+    tokens = list(_TOKEN.finditer(text))
+    chords = tuple((m.start(), m.group()) for m in tokens if is_chord(m.group()))
+    if chords and all(is_chord(m.group()) or _DECORATION.match(m.group()) for m in tokens):
+        return Line(_classify(text, chords), text, chords)
+    return Line(_classify(text, ()), text, ())
+
+
+class ChordSheet:
+    """
+    A parsed chord sheet. Rendered views are memoized per sheet, so switching
+    between keys only costs a dict lookup after the first time.
+    """
+
+    __slots__ = ('lines', 'key', '_views', '_lock')
+
+    def __init__(self, lines: tuple):
+        self.lines = lines
+        self.key = next((name for line in lines for _, name in line.chords if is_chord(name)), None)
+        self._views = {}
+        self._lock = threading.Lock()
+
+    def _shift(self, transpose: int, capo: int) -> tuple[int, bool]:
+        """Semitones to move the written chords, and whether the resulting key reads in flats."""
+        shift = (transpose - capo) % 12
+        if self.key is None:
+            return shift, False
+        root, suffix, _ = _chord_parts(self.key)
+        new_root = _FLATS[(_SEMITONES[root] + shift) % 12]
+        minor = suffix.startswith(('m', 'min', '-')) and not suffix.startswith(('maj', 'M'))
+        flats = new_root in (_FLAT_MINOR_KEYS if minor else _FLAT_MAJOR_KEYS)
+        return shift, flats
+
+    def key_for(self, transpose: int = 0) -> str | None:
+        """The sounding key (first chord) after transposing, e.g. to label the view."""
+        if self.key is None:
+            return None
+        shift, flats = self._shift(transpose, 0)
+        return transpose_chord(self.key, shift, flats)
+
+    def _view(self, fmt: str, transpose: int, capo: int) -> str:
+        shift, flats = self._shift(transpose, capo)
+        view_key = (fmt, shift, flats)
+        view = self._views.get(view_key)
+        if view is None:
+            render = _render_html_line if fmt == 'html' else _render_text_line
+            body = '\n'.join(render(line, shift, flats) for line in self.lines)
+            view = f'<pre class="chord-sheet">{body}</pre>' if fmt == 'html' else body
+            with self._lock:
+                self._views[view_key] = view
+        return view
+
+    def text(self, transpose: int = 0, capo: int = 0) -> str:
+        """
+        Plain text view. `transpose` moves the song by that many semitones;
+        `capo` shows the shapes to play with a capo on that fret.
+        """
+        return self._view('text', transpose, capo)
+
+    def html(self, transpose: int = 0, capo: int = 0) -> str:
+        """HTML view (escaped) with chords and section markers in <span>s, inside a <pre>."""
+        return self._view('html', transpose, capo)
+
+    def to_dict(self) -> dict:
+        """Compact JSON-friendly form: [kind, text, [[column, chord], ...]] per line."""
+        return {
+            'key': self.key,
+            'lines': [[line.kind, line.text, [list(chord) for chord in line.chords]] for line in self.lines],
+        }
+
+
+def _transposed_parts(line: Line, shift: int, flats: bool):
+    """
+    Yields ('text', s) and ('chord', s) pieces of a line with its chords moved.
+    On chord lines the spacing is adjusted so chords stay over the same lyric
+    column when their names change length.
+    """
+    pos = 0
+    drift = 0 # Characters written beyond the original layout
+    for column, name in line.chords:
+        gap = line.text[pos:column]
+        if drift and line.kind == 'chords' and (gap.isspace() or not gap):
+            width = max(1 if pos else 0, len(gap) - drift)
+            drift -= len(gap) - width
+            gap = ' ' * width
+        if gap:
+            yield 'text', gap
+        new = transpose_chord(name, shift, flats)
+        drift += len(new) - len(name)
+        yield 'chord', new
+        pos = column + len(name)
+    if pos < len(line.text):
+        yield 'text', line.text[pos:]
+
+
+def _render_text_line(line: Line, shift: int, flats: bool) -> str:
+    if not line.chords or not shift:
+        return line.text.rstrip()
+    return ''.join(piece for _, piece in _transposed_parts(line, shift, flats)).rstrip()
+
+
+def _render_html_line(line: Line, shift: int, flats: bool) -> str:
+    if line.kind == 'section':
+        return f'<span class="section">{html.escape(line.text.strip())}</span>'
+    parts = []
+    for kind, piece in _transposed_parts(line, shift, flats):
+        piece = html.escape(piece)
+        parts.append(f'<span class="chord">{piece}</span>' if kind == 'chord' else piece)
+    return ''.join(parts).rstrip()
+
+
+@functools.lru_cache(maxsize=SHEET_CACHE_SIZE)
+def parse(content: str) -> ChordSheet:
+    """
+    Parses provider content into a ChordSheet (memoized by content).
+
+    UG content is recognised by its [ch] markup; other text is treated as
+    chords-over-lyrics, with chord lines detected by their tokens.
+    """
+    content = _UG_TAB_TAG.sub('', content).replace('\r\n', '\n').strip('\n')
+    parse_line = _parse_markup_line if '[ch]' in content else _parse_plain_line
+    return ChordSheet(tuple(parse_line(raw) for raw in content.split('\n')))
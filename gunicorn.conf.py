@@ -0,0 +1,43 @@
+# Production gunicorn settings (gunicorn reads ./gunicorn.conf.py by default)
+#
+# The app is preloaded: Flask, requests, BeautifulSoup, the compiled patterns
+# and the warm caches are loaded once in the master and shared copy-on-write
+# by the forked workers, which boot faster and add less RSS each. Run with
+#   gunicorn app:app
+# and set CHORDBOT_PRELOAD=0 to load the app in every worker instead.
+import gc
+import os
+import sys
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+preload_app = os.environ.get('CHORDBOT_PRELOAD', '1') == '1'
+# A sync worker is killed once one request runs past `timeout` (keepalive
+# events don't count as progress), so keep it above the longest responses:
+# an /api/batch of CHORDBOT_BATCH_MAX_TIMEOUT seconds, and a lookup that waits
+# for another worker's scrape and then scrapes itself, which is bounded by
+# CHORDBOT_SINGLEFLIGHT_TIMEOUT (default 180 s, see ug_scraper.py).
+timeout = int(os.environ.get(
+    'CHORDBOT_WORKER_TIMEOUT',
+    str(int(max(float(os.environ.get('CHORDBOT_BATCH_MAX_TIMEOUT', '120')),
+                float(os.environ.get('CHORDBOT_SINGLEFLIGHT_TIMEOUT', '180')))) + 30),
+))
+
+
+def when_ready(server):
+    """Warms the preloaded app in the master, just before the first workers are forked."""
+    if not server.cfg.preload_app or 'app' not in sys.modules:
+        return
+    sys.modules['app'].warm_up()
+    # Keep the master's objects out of the workers' garbage collections, which
+    # would otherwise touch (and so copy) every shared page
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    """Gives each worker its own HTTP pools, SQLite connections and background threads."""
+    if 'ug_scraper' in sys.modules:
+        sys.modules['ug_scraper'].after_fork()
+    if 'async_scraper' in sys.modules:
+        sys.modules['async_scraper'].after_fork()
@@ -0,0 +1,154 @@
+# Latency and outcome metrics in Prometheus text format
+#
+# Metrics are kept per process; with several gunicorn workers each worker
+# serves its own numbers on /metrics. Every sample carries a worker="<pid>"
+# label so the workers' counters stay separate series instead of appearing to
+# jump backwards when a scrape lands on another worker; aggregate them in the
+# query, e.g. sum without (worker) (rate(chordbot_provider_outcomes_total[5m])).
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds (seconds) for the latency histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0)
+
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _with_worker(line: str, worker: str) -> str:
+    """Adds the worker label to an exposition sample line; comment lines are returned as is."""
+    if not line or line.startswith('#'):
+        return line
+    name_end = min(i for i in (line.find('{'), line.find(' ')) if i >= 0)
+    if line[name_end] == '{':
+        return f'{line[:name_end + 1]}worker="{worker}",{line[name_end + 1:]}'
+    return f'{line[:name_end]}{{worker="{worker}"}}{line[name_end:]}'
+
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(labels[name] for name in self.labelnames), 0)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels."""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {} # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    bucket_labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+                    lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+                inf_labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_bucket{inf_labels} {series[-1]}")
+                lines.append(f"{self.name}_sum{labels} {series[-2]}")
+                lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+# --- Registry ---
+
+STAGE_SECONDS = Histogram(
+    'chordbot_stage_seconds',
+    'Time spent per provider and stage (search_fetch, song_fetch, parse, extract, format, total).',
+    ('provider', 'stage'),
+)
+PROVIDER_OUTCOMES = Counter(
+    'chordbot_provider_outcomes_total',
+    'Provider attempts by outcome (hit, miss, timeout, error, cancelled, skipped).',
+    ('provider', 'outcome'),
+)
+LOOKUP_SECONDS = Histogram(
+    'chordbot_lookup_seconds',
+    'End-to-end get_song_chords latency by result source (cache, stale or provider scrape).',
+    ('source',),
+)
+REQUEST_SECONDS = Histogram(
+    'chordbot_request_seconds',
+    'HTTP request latency by route.',
+    ('route',),
+)
+
+REGISTRY = [STAGE_SECONDS, PROVIDER_OUTCOMES, LOOKUP_SECONDS, REQUEST_SECONDS]
+
+# Callables returning extra exposition lines (e.g. cache counters), run on each render
+_collectors = []
+
+
+def register_collector(collector):
+    """Adds a zero-argument callable that returns a list of exposition lines."""
+    _collectors.append(collector)
+
+
+@contextmanager
+def span(provider: str, stage: str):
+    """Times the enclosed block into chordbot_stage_seconds."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, provider=provider, stage=stage)
+
+
+def render() -> str:
+    """Returns all metrics in the Prometheus text exposition format, labelled with this worker's pid."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    for collector in _collectors:
+        lines.extend(collector())
+    worker = str(os.getpid())
+    return '\n'.join(_with_worker(line, worker) for line in lines) + '\n'
@@ -0,0 +1,247 @@
+# Adaptive provider ordering and circuit breakers
+#
+# Keeps a rolling window of outcomes per provider, moves the provider that
+# matches the query's language up and a provider that keeps failing down, and
+# stops calling a provider for a while after it keeps timing out or failing.
+# State is per process.
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Also rank providers by their recent hit rate and latency. Off by default: a
+# hit only means some page was found, not that it's as good as the one a
+# higher-priority provider would have returned.
+ADAPTIVE_ORDER = os.environ.get('CHORDBOT_ADAPTIVE_ORDER', '0') == '1'
+# Number of recent attempts per provider the stats are computed over
+STATS_WINDOW = int(os.environ.get('CHORDBOT_PROVIDER_STATS_WINDOW', '50'))
+# Consecutive timeouts/errors that open a provider's circuit (0 disables the breakers)
+BREAKER_FAILURES = int(os.environ.get('CHORDBOT_BREAKER_FAILURES', '5'))
+# Seconds an open circuit waits before letting a single probe request through
+BREAKER_COOLDOWN = float(os.environ.get('CHORDBOT_BREAKER_COOLDOWN', '60'))
+# Share of recent attempts that timed out or failed at which a provider is tried last
+DEMOTE_FAILURE_RATE = float(os.environ.get('CHORDBOT_DEMOTE_FAILURE_RATE', '0.5'))
+# How much a matching query language multiplies a provider's hit rate (ADAPTIVE_ORDER only)
+LANGUAGE_BOOST = float(os.environ.get('CHORDBOT_LANGUAGE_BOOST', '2.0'))
+
+# Outcomes (see metrics.PROVIDER_OUTCOMES) that count against a provider's circuit
+FAILURE_OUTCOMES = ('timeout', 'error')
+
+# Until a provider has some history its stats are blended with these priors,
+# so a cold start keeps the static order.
+# Attempts needed before a provider's failure rate can demote it
+_DEMOTE_MIN_ATTEMPTS = 5
+_PRIOR_ATTEMPTS = 4
+_PRIOR_HIT_RATE = 0.5
+_PRIOR_SECONDS = 2.0
+
+# --- Query language signals ---
+_WORD = re.compile(r"[^\W\d_]+")
+_SPANISH_CHARS = set('ñ¿¡')
+_PORTUGUESE_CHARS = set('ãõçâêôà')
+# Only words that are common in one language but not the other (or English)
+_SPANISH_WORDS = {
+    'el', 'la', 'los', 'las', 'del', 'y', 'mi', 'yo', 'una', 'cuando', 'amor', 'corazon',
+    'vida', 'quiero', 'noche', 'sin', 'eres', 'contigo', 'cancion',
+}
+_PORTUGUESE_WORDS = {
+    'da', 'das', 'nao', 'voce', 'meu', 'minha', 'pra', 'eu', 'coracao', 'saudade', 'quero',
+    'tudo', 'noite', 'sem', 'com', 'uma', 'ao', 'seu', 'sua', 'cancao',
+}
+
+
+def query_language(query: str) -> str | None:
+    """
+    Guesses whether a query is Spanish ('es') or Portuguese ('pt') from its
+    characters and common words. Returns None when there's no clear signal.
+    """
+    lowered = query.casefold()
+    spanish = sum(c in _SPANISH_CHARS for c in lowered) * 2
+    portuguese = sum(c in _PORTUGUESE_CHARS for c in lowered) * 2
+    plain = ''.join(c for c in unicodedata.normalize('NFKD', lowered) if not unicodedata.combining(c))
+    for word in _WORD.findall(plain):
+        spanish += word in _SPANISH_WORDS
+        portuguese += word in _PORTUGUESE_WORDS
+    if spanish > portuguese:
+        return 'es'
+    if portuguese > spanish:
+        return 'pt'
+    return None
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after `failures` consecutive failures; after `cooldown`
+    seconds one probe is let through (half-open), which closes the circuit on
+    success or reopens it on failure.
+    """
+
+    def __init__(self, failures: int = BREAKER_FAILURES, cooldown: float = BREAKER_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.times_opened = 0
+
+    @property
+    def is_open(self) -> bool:
+        """True while calls are being refused (cooldown not over, or a probe already running)."""
+        if self.opened_at is None:
+            return False
+        return self.probing or time.monotonic() - self.opened_at < self.cooldown
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead now. Claims the probe when half-open."""
+        if self.opened_at is None:
+            return True
+        if self.is_open:
+            return False
+        self.probing = True
+        return True
+
+    def record(self, failed: bool):
+        if not failed:
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self.probing = False
+            return
+        self.consecutive_failures += 1
+        if self.probing or (self.failures > 0 and self.consecutive_failures >= self.failures):
+            if self.opened_at is None:
+                self.times_opened += 1
+            self.opened_at = time.monotonic()
+            self.probing = False
+
+    def release(self):
+        """Gives up a claimed probe without an outcome (e.g. the call was cancelled)."""
+        self.probing = False
+
+
+class ProviderStats:
+    """Rolling window of (hit, failed, seconds) for one provider."""
+
+    def __init__(self, window: int = STATS_WINDOW):
+        self._attempts = deque(maxlen=window)
+
+    def add(self, hit: bool, failed: bool, seconds: float):
+        self._attempts.append((hit, failed, seconds))
+
+    def __len__(self) -> int:
+        return len(self._attempts)
+
+    @property
+    def hit_rate(self) -> float:
+        hits = sum(hit for hit, _, _ in self._attempts)
+        return (hits + _PRIOR_HIT_RATE * _PRIOR_ATTEMPTS) / (len(self._attempts) + _PRIOR_ATTEMPTS)
+
+    @property
+    def failure_rate(self) -> float:
+        if not self._attempts:
+            return 0.0
+        return sum(failed for _, failed, _ in self._attempts) / len(self._attempts)
+
+    @property
+    def mean_seconds(self) -> float:
+        """Mean time an attempt costs, failures (usually timeouts) included."""
+        total = sum(seconds for _, _, seconds in self._attempts)
+        return (total + _PRIOR_SECONDS * _PRIOR_ATTEMPTS) / (len(self._attempts) + _PRIOR_ATTEMPTS)
+
+
+class ProviderScheduler:
+    """
+    Orders providers for a query and gates them behind circuit breakers.
+
+    By default the static order is kept, except that a provider whose language
+    matches the query is moved to the front, and providers whose recent
+    failure rate reached DEMOTE_FAILURE_RATE, then those with an open circuit,
+    go last.
+
+    With `adaptive`, providers are instead tried in decreasing order of
+    expected hits per second spent (hit rate / mean attempt time), which
+    minimises the expected time to the first hit when trying them one after
+    another; a provider whose language matches the query gets its hit rate
+    multiplied by LANGUAGE_BOOST. Either way ties keep the static order.
+    """
+
+    def __init__(self, languages: dict | None = None, adaptive: bool = ADAPTIVE_ORDER,
+                 window: int = STATS_WINDOW, failures: int = BREAKER_FAILURES,
+                 cooldown: float = BREAKER_COOLDOWN):
+        self.languages = languages or {}
+        self.adaptive = adaptive
+        self._window = window
+        self._failures = failures
+        self._cooldown = cooldown
+        self._stats = {}
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name: str) -> tuple[ProviderStats, CircuitBreaker]:
+        if name not in self._stats:
+            self._stats[name] = ProviderStats(self._window)
+            self._breakers[name] = CircuitBreaker(self._failures, self._cooldown)
+        return self._stats[name], self._breakers[name]
+
+    def order(self, query: str, providers: list) -> list:
+        """Returns the (name, scraper) pairs in the order to try them for `query`."""
+        language = query_language(query)
+        with self._lock:
+            keys = {}
+            for name, _ in providers:
+                stats, breaker = self._get(name)
+                matches = language is not None and self.languages.get(name) == language
+                if self.adaptive:
+                    hit_rate = stats.hit_rate * (LANGUAGE_BOOST if matches else 1.0)
+                    keys[name] = (breaker.is_open, -hit_rate / stats.mean_seconds)
+                else:
+                    failing = len(stats) >= _DEMOTE_MIN_ATTEMPTS and stats.failure_rate >= DEMOTE_FAILURE_RATE
+                    keys[name] = (breaker.is_open, failing, not matches)
+        ordered = sorted(providers, key=lambda provider: keys[provider[0]])
+        if ordered != list(providers):
+            logger.debug("Provider order for %r (language %s): %s", query, language, [name for name, _ in ordered])
+        return ordered
+
+    def allow(self, name: str) -> bool:
+        """Whether `name` may be called now; False while its circuit is open."""
+        with self._lock:
+            return self._get(name)[1].allow()
+
+    def record(self, name: str, outcome: str, seconds: float):
+        """Feeds one attempt's outcome ('hit', 'miss', 'timeout', 'error', 'cancelled') and duration."""
+        with self._lock:
+            stats, breaker = self._get(name)
+            if outcome == 'cancelled':
+                breaker.release()
+                return
+            failed = outcome in FAILURE_OUTCOMES
+            was_open = breaker.opened_at is not None
+            stats.add(outcome == 'hit', failed, seconds)
+            breaker.record(failed)
+            now_open = breaker.opened_at is not None
+        if now_open and not was_open:
+            logger.warning("%s: Circuit opened after %d consecutive failures; skipping it for %.0fs",
+                           name, breaker.consecutive_failures, breaker.cooldown)
+        elif was_open and not now_open:
+            logger.info("%s: Circuit closed again", name)
+
+    def snapshot(self) -> dict:
+        """Per-provider stats and circuit state, for /stats/providers and /metrics."""
+        with self._lock:
+            return {
+                name: {
+                    'attempts': len(stats),
+                    'hit_rate': round(stats.hit_rate, 3),
+                    'failure_rate': round(stats.failure_rate, 3),
+                    'mean_seconds': round(stats.mean_seconds, 3),
+                    'circuit_open': self._breakers[name].is_open,
+                    'consecutive_failures': self._breakers[name].consecutive_failures,
+                    'times_opened': self._breakers[name].times_opened,
+                }
+                for name, stats in self._stats.items()
+            }
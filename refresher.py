@@ -0,0 +1,374 @@
+# Background cache refresher
+#
+# Tracks how often each query is asked for and keeps the most popular results
+# warm: expired results are served stale while a background worker refreshes
+# them, and the top queries are re-scraped shortly before they expire.
+#
+# The refresh pool always runs inside the app process (it handles stale hits).
+# The periodic prefetch loop either runs there too (CHORDBOT_REFRESHER=1) or in
+# its own process next to the app, sharing the SQLite cache:
+#
+#   python refresher.py            # prefetch loop until interrupted
+#   python refresher.py --once     # one pass, e.g. from cron
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import chord_cache
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Run the prefetch loop inside the app process
+REFRESHER_ENABLED = os.environ.get('CHORDBOT_REFRESHER', '1') == '1'
+# Number of most popular queries kept warm
+REFRESH_TOP_N = int(os.environ.get('CHORDBOT_REFRESH_TOP_N', '100'))
+# Seconds between prefetch passes
+REFRESH_INTERVAL = float(os.environ.get('CHORDBOT_REFRESH_INTERVAL', '300'))
+# Popular results are refreshed when they expire within this many seconds
+REFRESH_AHEAD = float(os.environ.get('CHORDBOT_REFRESH_AHEAD', str(12 * 3600)))
+# Background refreshes running at once
+REFRESH_WORKERS = int(os.environ.get('CHORDBOT_REFRESH_WORKERS', '2'))
+# Outbound requests per second per provider host made by background refreshes
+REFRESH_HOST_RATE = float(os.environ.get('CHORDBOT_REFRESH_HOST_RATE', '0.5'))
+REFRESH_HOST_BURST = int(os.environ.get('CHORDBOT_REFRESH_HOST_BURST', '2'))
+# A query's popularity halves after this many seconds without requests
+POPULARITY_HALF_LIFE = float(os.environ.get('CHORDBOT_POPULARITY_HALF_LIFE', str(24 * 3600)))
+# Seconds between writes of the popularity counters to the shared cache database
+POPULARITY_FLUSH_INTERVAL = float(os.environ.get('CHORDBOT_POPULARITY_FLUSH_INTERVAL', '30'))
+
+
+def _decayed(score: float, since: float, now: float, half_life: float) -> float:
+    return score * math.pow(0.5, max(0.0, now - since) / half_life)
+
+
+class PopularityTracker:
+    """
+    Exponentially decaying request counts per normalized query.
+
+    Counts are kept in memory and, when a database path is given, merged into
+    a `popularity` table in the cache database every flush, so all gunicorn
+    workers and a separate refresher process see the same ranking. Periodic
+    flushes run on a background thread so a request never waits on SQLite.
+    """
+
+    def __init__(self, path: str | None = chord_cache.CACHE_PATH, half_life: float = POPULARITY_HALF_LIFE,
+                 flush_interval: float = POPULARITY_FLUSH_INTERVAL):
+        self.path = path
+        self.half_life = half_life
+        self.flush_interval = flush_interval
+        self._last_flush = time.monotonic()
+        self._scores = {} # key -> [score, updated_at, query]
+        self._pending = {} # key -> [count, query], not yet flushed
+        self._flushing = False
+        self._lock = threading.Lock() # Guards the counters
+        self._db_lock = threading.Lock() # Guards the connection
+        self._conn = None
+        self._conn_failed = False
+
+    def _connect(self) -> sqlite3.Connection | None:
+        """Opens the database on first use (call with _db_lock held)."""
+        if self._conn is None and self.path and not self._conn_failed:
+            try:
+                conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS popularity ('
+                    ' key TEXT PRIMARY KEY,'
+                    ' query TEXT NOT NULL,'
+                    ' score REAL NOT NULL,'
+                    ' updated_at REAL NOT NULL)'
+                )
+                self._conn = conn
+            except sqlite3.Error as e:
+                logger.warning("Refresher: Could not open %s, tracking popularity in memory only: %s", self.path, e)
+                self._conn_failed = True
+        return self._conn
+
+    def track(self, query: str):
+        """Counts one request for `query`; every flush_interval seconds a background flush is started."""
+        key = chord_cache.normalize_query(query)
+        now = time.time()
+        with self._lock:
+            entry = self._scores.get(key)
+            if entry is None:
+                self._scores[key] = [1.0, now, query]
+            else:
+                entry[0] = _decayed(entry[0], entry[1], now, self.half_life) + 1
+                entry[1] = now
+            pending = self._pending.setdefault(key, [0, query])
+            pending[0] += 1
+            flush = self.path and not self._flushing and time.monotonic() - self._last_flush >= self.flush_interval
+            if flush:
+                self._last_flush = time.monotonic()
+                self._flushing = True
+        if flush:
+            threading.Thread(target=self._background_flush, name='popularity-flush', daemon=True).start()
+
+    def _background_flush(self):
+        try:
+            self.flush()
+        finally:
+            self._flushing = False
+
+    def flush(self):
+        """Merges the counts gathered since the last flush into the database."""
+        if not self.path:
+            return
+        now = time.time()
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        try:
+            with self._db_lock:
+                conn = self._connect()
+                if conn is None or not pending:
+                    return
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    for key, (count, query) in pending.items():
+                        row = conn.execute('SELECT score, updated_at FROM popularity WHERE key = ?', (key,)).fetchone()
+                        score = count + (_decayed(row[0], row[1], now, self.half_life) if row else 0.0)
+                        conn.execute(
+                            'INSERT OR REPLACE INTO popularity (key, query, score, updated_at) VALUES (?, ?, ?, ?)',
+                            (key, query, score, now),
+                        )
+                    conn.execute('COMMIT')
+                except BaseException:
+                    conn.execute('ROLLBACK')
+                    raise
+        except sqlite3.Error as e:
+            logger.warning("Refresher: Could not save popularity counters: %s", e)
+
+    def after_fork(self):
+        """
+        Drops state inherited from the parent process: its database connection
+        (not usable across fork()) and its unflushed counts, which the parent
+        flushes itself.
+        """
+        self._conn = None
+        self._conn_failed = False
+        self._pending = {}
+        self._flushing = False
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+
+    def top(self, n: int) -> list:
+        """The `n` most popular queries, most popular first."""
+        now = time.time()
+        if self.path:
+            try:
+                with self._db_lock:
+                    conn = self._connect()
+                    rows = conn.execute('SELECT query, score, updated_at FROM popularity').fetchall() if conn else None
+            except sqlite3.Error as e:
+                logger.warning("Refresher: Could not read popularity counters: %s", e)
+                rows = None
+            if rows is not None:
+                ranked = sorted(rows, key=lambda row: _decayed(row[1], row[2], now, self.half_life), reverse=True)
+                return [query for query, _, _ in ranked[:n]]
+        with self._lock:
+            ranked = sorted(self._scores.values(), key=lambda e: _decayed(e[0], e[1], now, self.half_life), reverse=True)
+            return [query for _, _, query in ranked[:n]]
+
+    def prune(self, keep: int):
+        """Forgets all but roughly the `keep` most popular queries."""
+        now = time.time()
+        with self._lock:
+            if len(self._scores) > keep:
+                ranked = sorted(self._scores, key=lambda k: _decayed(self._scores[k][0], self._scores[k][1], now, self.half_life), reverse=True)
+                for key in ranked[keep:]:
+                    del self._scores[key]
+        with self._db_lock:
+            conn = self._connect()
+            if conn is None:
+                return
+            try:
+                # Ranked by the stored, undecayed score: close enough for trimming
+                conn.execute(
+                    'DELETE FROM popularity WHERE key NOT IN ('
+                    ' SELECT key FROM popularity ORDER BY score DESC LIMIT ?)',
+                    (keep,),
+                )
+            except sqlite3.Error as e:
+                logger.warning("Refresher: Could not prune popularity counters: %s", e)
+
+
+class HostRateLimiter:
+    """Token bucket per host: at most `rate` requests per second, bursts of `burst`."""
+
+    def __init__(self, rate: float = REFRESH_HOST_RATE, burst: int = REFRESH_HOST_BURST):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._buckets = {} # host -> [tokens, updated_at]
+        self._lock = threading.Lock()
+
+    def acquire(self, url: str):
+        """Blocks until a request to `url`'s host is allowed."""
+        if self.rate <= 0:
+            return
+        host = urllib.parse.urlsplit(url).netloc
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                bucket = self._buckets.setdefault(host, [float(self.burst), now])
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+                if bucket[0] >= 1:
+                    bucket[0] -= 1
+                    return
+                wait = (1 - bucket[0]) / self.rate
+            time.sleep(wait)
+
+
+class Refresher:
+    """
+    Refreshes cached results off the request path.
+
+    `refresh_fn(query)` does the actual work (for ug_scraper, a throttled
+    re-scrape that updates the cache); it runs on a small thread pool, and a
+    query already queued or running is not submitted twice.
+    """
+
+    def __init__(self, refresh_fn, cache: chord_cache.ChordCache, popularity: PopularityTracker,
+                 workers: int = REFRESH_WORKERS, top_n: int = REFRESH_TOP_N,
+                 interval: float = REFRESH_INTERVAL, refresh_ahead: float = REFRESH_AHEAD):
+        self.refresh_fn = refresh_fn
+        self.cache = cache
+        self.popularity = popularity
+        self.workers = workers
+        self.top_n = top_n
+        self.interval = interval
+        self.refresh_ahead = refresh_ahead
+        self._executor = None
+        self._queued = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.refreshed = 0
+        self.failed = 0
+
+    def submit(self, query: str) -> bool:
+        """Queues a background refresh of `query`. Returns False if one is already queued."""
+        key = chord_cache.normalize_query(query)
+        with self._lock:
+            if key in self._queued:
+                return False
+            self._queued.add(key)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='refresh')
+            self._executor.submit(self._run, key, query)
+        return True
+
+    def _run(self, key: str, query: str):
+        try:
+            self.refresh_fn(query)
+            self.refreshed += 1
+        except Exception:
+            self.failed += 1
+            logger.exception("Refresher: Refresh failed for: %s", query)
+        finally:
+            with self._lock:
+                self._queued.discard(key)
+
+    def due(self, query: str) -> bool:
+        """
+        Whether `query` has found chords cached that expire within refresh_ahead
+        seconds. Not-found results and uncached queries are left to user
+        requests, so a popular query nobody has chords for isn't re-scraped
+        every pass. Reads the shared tier, so a query another worker has just
+        refreshed isn't due here.
+        """
+        entry = self.cache.get_shared(query, allow_stale=True)
+        return entry is not None and entry.found and entry.expires_at - time.time() < self.refresh_ahead
+
+    def run_once(self) -> int:
+        """Flushes the popularity counters and queues every popular query that is due. Returns how many."""
+        self.popularity.flush()
+        self.popularity.prune(self.top_n * 10)
+        queued = 0
+        for query in self.popularity.top(self.top_n):
+            if self.due(query) and self.submit(query):
+                queued += 1
+        if queued:
+            logger.info("Refresher: Queued %d popular queries for refresh", queued)
+        return queued
+
+    def run_forever(self):
+        """Runs a prefetch pass every `interval` seconds until stop()."""
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Refresher: Prefetch pass failed")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Starts the prefetch loop on a daemon thread (once per process)."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run_forever, name='refresher', daemon=True)
+            self._thread.start()
+
+    def stop(self, wait: bool = False):
+        self._stop.set()
+        self.popularity.flush()
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=not wait)
+
+    def after_fork(self):
+        """Forgets the parent's threads and queue; a forked child starts with neither running."""
+        self._executor = None
+        self._queued = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.refreshed = 0
+        self.failed = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            queued = len(self._queued)
+        return {
+            'running': self._thread is not None and self._thread.is_alive(),
+            'queued': queued,
+            'refreshed': self.refreshed,
+            'failed': self.failed,
+        }
+
+
+def main(argv=None):
+    import argparse
+
+    import ug_scraper
+
+    parser = argparse.ArgumentParser(description='Keep the most popular chord results warm in the shared cache.')
+    parser.add_argument('--once', action='store_true', help='Run a single prefetch pass and wait for it to finish')
+    parser.add_argument('--top', type=int, default=REFRESH_TOP_N, help=f'Number of popular queries to keep warm (default: {REFRESH_TOP_N})')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if ug_scraper.RESULT_CACHE.disk is None:
+        parser.error("CHORDBOT_CACHE_PATH is empty; a separate refresher needs the shared SQLite cache")
+    refresher = ug_scraper.REFRESHER
+    refresher.top_n = args.top
+    try:
+        if args.once:
+            refresher.run_once()
+            refresher.stop(wait=True)
+        else:
+            refresher.run_forever()
+    except KeyboardInterrupt:
+        refresher.stop()
+
+
+if __name__ == '__main__':
+    main()
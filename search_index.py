@@ -0,0 +1,270 @@
+# Search-result index
+#
+# Remembers every candidate a provider search returned (not just the one we
+# used), keyed by a normalized artist/title signature, so repeat queries can
+# go straight to the song page and alternate versions can be offered without
+# searching again. Stored next to the result cache in SQLite
+# so all workers share it.
+import difflib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import NamedTuple
+
+import chord_cache
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# How long a provider's candidate list is trusted before searching again
+INDEX_TTL = int(os.environ.get('CHORDBOT_INDEX_TTL', str(30 * 24 * 3600)))
+# Minimum similarity (0-1) between signatures for a fuzzy match when listing
+# versions; 1 (the default) disables fuzzy lookups. Scrapes never use them:
+# "Let It Be Me" and "Let It Be" are different songs with similar signatures.
+INDEX_FUZZY_RATIO = float(os.environ.get('CHORDBOT_INDEX_FUZZY_RATIO', '1'))
+# Seconds between loads of signatures other workers added, for fuzzy lookups
+INDEX_RELOAD_INTERVAL = float(os.environ.get('CHORDBOT_INDEX_RELOAD_INTERVAL', '30'))
+
+_WORD = re.compile(r'\w+')
+# Words that don't identify a song
+_NOISE_WORDS = {'chords', 'chord', 'tab', 'tabs', 'acordes', 'cifra', 'letra', 'lyrics', 'by', 'de', 'the', 'a', 'el', 'la'}
+
+
+def signature(text: str) -> str:
+    """
+    Order-independent key for an artist/title string: normalized words minus
+    noise words, deduplicated and sorted ("Oasis - Wonderwall" == "wonderwall oasis").
+    """
+    words = set(_WORD.findall(chord_cache.normalize_query(text))) - _NOISE_WORDS
+    return ' '.join(sorted(words))
+
+
+class Candidate(NamedTuple):
+    """One search result. type/version/rating/votes are only known for UG."""
+    url: str
+    title: str = ''
+    artist: str = ''
+    type: str = ''
+    version: int = 0
+    rating: float = 0.0
+    votes: int = 0
+
+
+class SearchIndex:
+    """
+    (provider, signature) -> candidate list, in SQLite when a path is given,
+    otherwise in memory. Exact lookups hit the table's primary key; fuzzy
+    lookups (opt-in) compare against the signatures sharing a word with the query.
+    """
+
+    def __init__(self, path: str | None = chord_cache.CACHE_PATH, ttl: int = INDEX_TTL,
+                 fuzzy_ratio: float = INDEX_FUZZY_RATIO):
+        self.path = path
+        self.ttl = ttl
+        self.fuzzy_ratio = fuzzy_ratio
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._rows = {} # (provider, sig) -> (expires_at, candidates), when there is no database
+        self._by_word = {} # word -> {(provider, sig)}, for fuzzy lookups
+        self._loaded_until = 0.0
+        self._next_reload = 0.0
+        self.hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+
+    def _connect(self) -> sqlite3.Connection | None:
+        if not self.path:
+            return None
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS search_index ('
+                ' provider TEXT NOT NULL,'
+                ' sig TEXT NOT NULL,'
+                ' candidates TEXT NOT NULL,'
+                ' updated_at REAL NOT NULL,'
+                ' expires_at REAL NOT NULL,'
+                ' PRIMARY KEY (provider, sig))'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS search_index_updated ON search_index (updated_at)')
+            self._local.conn = conn
+        return conn
+
+    def _remember_sig(self, provider: str, sig: str):
+        for word in sig.split():
+            self._by_word.setdefault(word, set()).add((provider, sig))
+
+    def _load_new_sigs(self):
+        """Picks up signatures written by other processes since the last load."""
+        now = time.monotonic()
+        if now < self._next_reload:
+            return
+        self._next_reload = now + INDEX_RELOAD_INTERVAL
+        conn = self._connect()
+        if conn is None:
+            return
+        rows = conn.execute(
+            'SELECT provider, sig, updated_at FROM search_index WHERE updated_at > ? AND expires_at > ?',
+            (self._loaded_until, time.time()),
+        ).fetchall()
+        with self._lock:
+            for provider, sig, updated_at in rows:
+                self._remember_sig(provider, sig)
+                self._loaded_until = max(self._loaded_until, updated_at)
+
+    def _get(self, provider: str, sig: str) -> list | None:
+        conn = self._connect()
+        if conn is None:
+            with self._lock:
+                row = self._rows.get((provider, sig))
+        else:
+            row = conn.execute(
+                'SELECT expires_at, candidates FROM search_index WHERE provider = ? AND sig = ?', (provider, sig)
+            ).fetchone()
+        if row is None or row[0] <= time.time():
+            return None
+        candidates = row[1]
+        if isinstance(candidates, str):
+            candidates = [Candidate(*c) for c in json.loads(candidates)]
+        return list(candidates)
+
+    def _put(self, provider: str, sig: str, candidates: list):
+        now = time.time()
+        conn = self._connect()
+        if conn is None:
+            with self._lock:
+                self._rows[(provider, sig)] = (now + self.ttl, tuple(candidates))
+        else:
+            conn.execute(
+                'INSERT OR REPLACE INTO search_index (provider, sig, candidates, updated_at, expires_at)'
+                ' VALUES (?, ?, ?, ?, ?)',
+                (provider, sig, json.dumps([list(c) for c in candidates], ensure_ascii=False), now, now + self.ttl),
+            )
+        with self._lock:
+            self._remember_sig(provider, sig)
+
+    def lookup(self, provider: str, query: str, fuzzy: bool = False) -> list | None:
+        """
+        Returns the candidates `provider` listed for `query`, best first, or
+        None if we have to search. With `fuzzy` (and fuzzy_ratio below 1), a
+        near-identical signature also matches; those candidates may belong to
+        another song, so only use them where the user picks from the list.
+        """
+        sig = signature(query)
+        if not sig:
+            return None
+        try:
+            candidates = self._get(provider, sig)
+            if candidates:
+                self.hits += 1
+                return candidates
+            if fuzzy and self.fuzzy_ratio < 1:
+                match = self._fuzzy_match(provider, sig)
+                if match is not None:
+                    candidates = self._get(provider, match)
+                    if candidates:
+                        logger.debug("Index: '%s' matched '%s' for %s", sig, match, provider)
+                        self.fuzzy_hits += 1
+                        return candidates
+        except sqlite3.Error as e:
+            logger.warning("Index: Lookup failed: %s", e)
+        self.misses += 1
+        return None
+
+    def _fuzzy_match(self, provider: str, sig: str) -> str | None:
+        self._load_new_sigs()
+        with self._lock:
+            others = set()
+            for word in sig.split():
+                others.update(other for p, other in self._by_word.get(word, ()) if p == provider)
+        best, best_ratio = None, self.fuzzy_ratio
+        matcher = difflib.SequenceMatcher(None, b=sig) # b is the side SequenceMatcher caches
+        for other in others:
+            matcher.set_seq1(other)
+            if matcher.real_quick_ratio() < best_ratio or matcher.quick_ratio() < best_ratio:
+                continue
+            ratio = matcher.ratio()
+            if ratio >= best_ratio:
+                best, best_ratio = other, ratio
+        return best
+
+    def record(self, provider: str, query: str, candidates: list):
+        """
+        Stores a search's candidates under the query's signature, and each
+        song's own candidates under its artist/title signature when known.
+        """
+        if not candidates:
+            return
+        try:
+            sig = signature(query)
+            if sig:
+                self._put(provider, sig, candidates)
+            by_song = {}
+            for candidate in candidates:
+                if candidate.title and candidate.artist:
+                    by_song.setdefault(signature(f"{candidate.title} {candidate.artist}"), []).append(candidate)
+            for song_sig, song_candidates in by_song.items():
+                if song_sig and song_sig != sig:
+                    self._put(provider, song_sig, song_candidates)
+        except sqlite3.Error as e:
+            logger.warning("Index: Write failed: %s", e)
+
+    def forget(self, provider: str, query: str):
+        """Drops the entry `query` resolves to, e.g. after its song page went missing."""
+        sig = signature(query)
+        try:
+            conn = self._connect()
+            if conn is None:
+                with self._lock:
+                    self._rows.pop((provider, sig), None)
+            else:
+                conn.execute('DELETE FROM search_index WHERE provider = ? AND sig = ?', (provider, sig))
+        except sqlite3.Error as e:
+            logger.warning("Index: Delete failed: %s", e)
+
+    def knows_url(self, url: str) -> str | None:
+        """The provider that listed `url` as a candidate, if any (used to vet version requests)."""
+        conn = self._connect()
+        pattern = json.dumps(url, ensure_ascii=False)
+        if conn is None:
+            with self._lock:
+                for (provider, _), (_, candidates) in self._rows.items():
+                    if any(c.url == url for c in candidates):
+                        return provider
+            return None
+        row = conn.execute(
+            "SELECT provider FROM search_index WHERE instr(candidates, ?) > 0 LIMIT 1", (pattern,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def warm(self) -> int:
+        """Loads every live signature for fuzzy lookups now instead of on first use. Returns how many are known."""
+        self._next_reload = 0.0
+        try:
+            self._load_new_sigs()
+        except sqlite3.Error as e:
+            logger.warning("Index: Could not load signatures: %s", e)
+        with self._lock:
+            return len({key for keys in self._by_word.values() for key in keys})
+
+    def close(self):
+        """Closes this thread's connection (the next call reopens it)."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def after_fork(self):
+        """Drops connections inherited from the parent process; the loaded signatures are kept."""
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.hits = self.fuzzy_hits = self.misses = 0
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'fuzzy_hits': self.fuzzy_hits, 'misses': self.misses}
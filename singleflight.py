@@ -0,0 +1,134 @@
+# Request coalescing: one in-flight scrape per query
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError: # Not available on Windows; cross-process locking is skipped there
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Directory holding the cross-process lock files and how many of them to use.
+# Queries are hashed onto a fixed set of files so the directory never grows;
+# two different queries sharing a file just take turns.
+LOCK_DIR = os.environ.get('CHORDBOT_LOCK_DIR', os.path.join(tempfile.gettempdir(), 'chordbot-locks'))
+LOCK_STRIPES = int(os.environ.get('CHORDBOT_LOCK_STRIPES', '1024'))
+
+
+class _Call:
+    """An in-flight call that followers wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key within a process.
+
+    The first caller (the leader) runs the function; callers arriving while
+    it runs wait for and share its result or exception.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn, timeout: float | None = None):
+        """
+        Runs fn() once for all concurrent callers with the same key.
+
+        Args:
+            key: Identifies identical calls.
+            fn: Zero-argument callable to run if no call for `key` is in flight.
+            timeout: Seconds a follower waits for the leader (None waits forever).
+
+        Returns:
+            The leader's return value.
+
+        Raises:
+            TimeoutError: If a follower gave up waiting for the leader.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if not call.done.wait(timeout):
+                raise TimeoutError(f"Timed out after {timeout}s waiting for in-flight call")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self) -> int:
+        """Number of keys currently being computed."""
+        with self._lock:
+            return len(self._calls)
+
+
+class FileLock:
+    """
+    Exclusive lock on a key shared by all processes on this machine (flock).
+
+    Used so only one gunicorn worker scrapes a given query at a time; the
+    others wait and then find the result in the shared cache.
+    """
+
+    def __init__(self, key: str, lock_dir: str = LOCK_DIR, stripes: int = LOCK_STRIPES):
+        stripe = int(hashlib.sha1(key.encode('utf-8')).hexdigest(), 16) % stripes
+        self.path = os.path.join(lock_dir, f"{stripe:04x}.lock")
+        self._fd = None
+
+    def acquire(self, timeout: float | None = None, poll_interval: float = 0.05) -> bool:
+        """
+        Waits up to `timeout` seconds for the lock.
+
+        Returns:
+            True if the lock was taken, False on timeout or if file locking is
+            unavailable (the caller should then carry on unlocked).
+        """
+        if fcntl is None:
+            return False
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError as e:
+            logger.warning("SingleFlight: Could not open lock file %s: %s", self.path, e)
+            return False
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self._fd = fd
+                return True
+            except BlockingIOError:
+                if deadline is not None and time.monotonic() >= deadline:
+                    os.close(fd)
+                    return False
+                time.sleep(poll_interval)
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
@@ -1,182 +1,613 @@
 # Ultimate Guitar Scraper
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, ReadTimeoutError
+from urllib3.util.retry import Retry
 from bs4 import BeautifulSoup
+import codecs
+import contextvars
+import html
 import json
 import re
 import urllib.parse
+import logging
 import os # Import os to check environment variables
+import chord_cache
+import chord_sheet
+import metrics
+import provider_scheduler
+import queue
+import refresher
+import search_index
+import singleflight
+import threading
+import time
+from typing import NamedTuple
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED, TimeoutError as FuturesTimeoutError
+
+logger = logging.getLogger(__name__)
 
 # --- PythonAnywhere Proxy Setup ---
 # Check if running on PythonAnywhere and set up proxy if needed
 PA_PROXY = None
 if 'PYTHONANYWHERE_SITE' in os.environ:
-    print("Detected PythonAnywhere environment. Configuring proxy.")
+    logger.info("Detected PythonAnywhere environment. Configuring proxy.")
     proxy_url = 'http://proxy.server:3128'
     PA_PROXY = {
         "http": proxy_url,
         "https": proxy_url,
     }
 
+# --- Provider Scheduling ---
+# How get_song_chords runs the providers:
+#   'sequential' - try them one after another (the original behaviour)
+#   'race'       - start all providers at once
+#   'hedged'     - start the next provider after CHORDBOT_HEDGE_DELAY seconds,
+#                  or immediately once everything already running has failed
+PROVIDER_MODE = os.environ.get('CHORDBOT_PROVIDER_MODE', 'sequential')
+HEDGE_DELAY = float(os.environ.get('CHORDBOT_HEDGE_DELAY', '1.5'))
+PROVIDER_MODES = ('sequential', 'race', 'hedged')
+# Threads shared by all concurrent ('race'/'hedged') lookups in a process. They
+# live as long as the worker, so the per-thread SQLite connections (cache and
+# search index) are opened once rather than on every lookup. Size it for the
+# lookups that run at once times the number of providers.
+PROVIDER_WORKERS = int(os.environ.get('CHORDBOT_PROVIDER_WORKERS', '32'))
+
+
+# Provider names, as used in logs, metrics and cache entries
+UG = 'Ultimate Guitar'
+LACUERDA = 'LaCuerda'
+CIFRACLUB = 'CifraClub'
+
+
+class ScraperError(Exception):
+    """
+    Raised by a provider when it could not produce chords; the message says why.
+
+    `outcome` classifies the failure for metrics: 'miss' (the site has no such
+    song), 'timeout' or 'error'.
+    """
+
+    def __init__(self, message: str, outcome: str = 'error'):
+        super().__init__(message)
+        self.outcome = outcome
+
+
+def _cancelled(cancel: threading.Event | None) -> bool:
+    """True if the caller no longer needs this provider's result."""
+    return cancel is not None and cancel.is_set()
+
+# --- HTTP Sessions ---
+# One pooled keep-alive session per upstream host, so repeated searches and tab
+# fetches reuse connections instead of paying DNS + TCP + TLS every time.
+HTTP_POOL_SIZE = int(os.environ.get('CHORDBOT_HTTP_POOL_SIZE', '10'))
+HTTP_RETRIES = int(os.environ.get('CHORDBOT_HTTP_RETRIES', '2'))
+HTTP_BACKOFF = float(os.environ.get('CHORDBOT_HTTP_BACKOFF', '0.3'))
+HTTP_BACKOFF_JITTER = float(os.environ.get('CHORDBOT_HTTP_BACKOFF_JITTER', '0.3'))
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _new_session() -> requests.Session:
+    """
+    Creates a session with a connection pool and retries for transient errors:
+    failed connects and 5xx responses. Read timeouts are not retried, since
+    each attempt could take the whole timeout again.
+    """
+    retry = Retry(
+        total=HTTP_RETRIES,
+        connect=HTTP_RETRIES,
+        read=0,
+        status=HTTP_RETRIES,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        backoff_factor=HTTP_BACKOFF,
+        backoff_jitter=HTTP_BACKOFF_JITTER,
+        raise_on_status=False, # Hand the last response back so raise_for_status() still works
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def _is_timeout(error: requests.exceptions.RequestException) -> bool:
+    """
+    Whether a request failed by timing out. Read timeouts that hit the retry
+    limit, or happen while streaming the body, arrive as a ConnectionError
+    wrapping urllib3's ReadTimeoutError rather than as requests' Timeout.
+    """
+    if isinstance(error, requests.exceptions.Timeout):
+        return True
+    cause = error.args[0] if error.args else None
+    if isinstance(cause, MaxRetryError):
+        cause = cause.reason
+    return isinstance(cause, ReadTimeoutError)
+
+
+def get_session(url: str) -> requests.Session:
+    """Returns the shared session for the host of `url`, creating it on first use."""
+    host = urllib.parse.urlsplit(url).netloc.lower()
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = _sessions[host] = _new_session()
+        return session
+
+
+def close_sessions():
+    """Closes all pooled sessions. The next request opens fresh ones."""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+# --- Upstream Override ---
+# Sends every provider request to a stand-in server instead of the real sites
+# (see bench/). https://lacuerda.net/tabs/x is then fetched as
+# {UPSTREAM_OVERRIDE}/lacuerda.net/tabs/x.
+UPSTREAM_OVERRIDE = os.environ.get('CHORDBOT_UPSTREAM_OVERRIDE', '')
+
+
+def upstream_url(url: str) -> str:
+    """Rewrites a provider URL to point at UPSTREAM_OVERRIDE, if one is set."""
+    if not UPSTREAM_OVERRIDE or url.startswith(UPSTREAM_OVERRIDE):
+        return url
+    parts = urllib.parse.urlsplit(url)
+    rewritten = f"{UPSTREAM_OVERRIDE.rstrip('/')}/{parts.netloc}{parts.path or '/'}"
+    return f"{rewritten}?{parts.query}" if parts.query else rewritten
+
+
 # --- Helper function for requests ---
+# Background refreshes set a HostRateLimiter here to throttle their requests. A
+# context variable rather than a thread-local, so it also follows asyncio tasks.
+_FETCH_LIMITER = contextvars.ContextVar('fetch_limiter', default=None)
+
+
 def make_request(url, **kwargs):
-    """Wrapper for requests.get that adds proxy if running on PythonAnywhere."""
-    if PA_PROXY:
+    """Wrapper for a pooled GET that adds proxy if running on PythonAnywhere."""
+    limiter = _FETCH_LIMITER.get()
+    if limiter is not None:
+        limiter.acquire(url)
+    url = upstream_url(url)
+    if PA_PROXY and not UPSTREAM_OVERRIDE:
         kwargs['proxies'] = PA_PROXY
         # Might need to disable SSL verification if proxy causes issues, but try without first
         # kwargs['verify'] = False
-    print(f"Making request to: {url} with proxy: {PA_PROXY is not None}")
-    return requests.get(url, **kwargs)
+    logger.debug("Making request to: %s with proxy: %s", url, PA_PROXY is not None)
+    return get_session(url).get(url, **kwargs)
+
+
+# --- Streaming page fetch ---
+# Pages are read incrementally and only decoded up to the point where the
+# element the scraper needs has been closed, or the byte budget is spent.
+# Stopping the download there closes the connection (the rest of the body is
+# still in flight), costing a new TCP/TLS handshake on the next request to that
+# host, so it's only done when a large part of the page is left; a smaller or
+# unknown remainder is read and thrown away, and the connection is reused.
+STREAM_PAGES = os.environ.get('CHORDBOT_STREAM_PAGES', '1') == '1'
+MAX_PAGE_BYTES = int(os.environ.get('CHORDBOT_MAX_PAGE_BYTES', str(3 * 1024 * 1024)))
+# Unread bytes (per Content-Length) that make closing the connection early worth it
+EARLY_STOP_MIN_BYTES = int(os.environ.get('CHORDBOT_EARLY_STOP_MIN_BYTES', str(256 * 1024)))
+STREAM_CHUNK_SIZE = 16 * 1024
+# How far back to rescan when a marker may straddle two chunks
+_MARKER_OVERLAP = 256
+
+# Stop markers: (opening tag pattern, closing tag) pairs. Reading stops once
+# any opening tag has been seen and its closing tag follows it.
+UG_STORE_MARKERS = [(re.compile(r'<div[^>]*js-store', re.IGNORECASE), '</div>')]
+LACUERDA_SEARCH_MARKERS = [(re.compile(r'<table[^>]*class=["\']?tbl', re.IGNORECASE), '</table>')]
+LACUERDA_SONG_MARKERS = [(re.compile(r'<pre[^>]*id=["\']?tab_content', re.IGNORECASE), '</pre>')]
+CIFRACLUB_SEARCH_MARKERS = [
+    (re.compile(r'<pre\b', re.IGNORECASE), '</pre>'), # Landed directly on a song page
+    (re.compile(r'<ol[^>]*list-links', re.IGNORECASE), '</ol>'),
+]
+CIFRACLUB_SONG_MARKERS = [(re.compile(r'<pre\b', re.IGNORECASE), '</pre>')]
+
+# Request timeouts (seconds) of the provider page fetches
+UG_FETCH_TIMEOUT = 15
+LACUERDA_FETCH_TIMEOUT = 10
+CIFRACLUB_SEARCH_TIMEOUT = 15
+CIFRACLUB_SONG_TIMEOUT = 10
+# Roughly the longest a full sequential scrape takes: every provider's search
+# and song fetch running into its timeout, plus slack for connect retries
+SCRAPE_WORST_SECONDS = (2 * UG_FETCH_TIMEOUT + 2 * LACUERDA_FETCH_TIMEOUT
+                        + CIFRACLUB_SEARCH_TIMEOUT + CIFRACLUB_SONG_TIMEOUT + 15)
+
+
+def _markers_complete(window: str, offset: int, markers: list, starts: list) -> bool:
+    """
+    Checks newly read text for a completed marker pair. `window` is that text
+    plus the last _MARKER_OVERLAP characters read before it, and starts at
+    `offset` in the page. `starts` holds, per pair, where in the page its
+    opening tag ended (or None) across calls.
+    """
+    for i, (start_pattern, end_tag) in enumerate(markers):
+        if starts[i] is None:
+            match = start_pattern.search(window)
+            if not match:
+                continue
+            starts[i] = offset + match.end()
+        if window.find(end_tag, max(starts[i] - offset, 0)) != -1:
+            return True
+    return False
+
+
+def _stop_early(content_length: str | None, downloaded: int) -> bool:
+    """
+    Whether to stop downloading a page whose needed content has arrived, given
+    its Content-Length header and the body bytes received so far.
+    """
+    try:
+        return int(content_length) - downloaded >= EARLY_STOP_MIN_BYTES
+    except (TypeError, ValueError):
+        return False # Unknown length: drain it
 
 
-# --- LaCuerda Scraper ---
+def _page_encoding(encoding: str | None, headers) -> str:
+    """
+    The encoding to decode a page with: `encoding` if given, else the charset
+    in its Content-Type, else ISO-8859-1 for text/* (the HTTP default, which
+    requests also applies; LaCuerda's search pages rely on it), else UTF-8.
+    """
+    return encoding or requests.utils.get_encoding_from_headers(headers) or 'utf-8'
+
 
-def _scrape_lacuerda(query: str) -> str | None:
+class _PageReader:
+    """
+    Decodes a streamed page chunk by chunk, for both engines' fetch_page.
+
+    Text is kept until the stop markers are complete or max_bytes have been
+    read. After the markers the rest of the body is only counted, or reading
+    stops outright when _stop_early says closing the connection is worth it.
     """
-    Internal function to scrape LaCuerda.net.
+
+    def __init__(self, url: str, encoding: str, stop_at: list | None, max_bytes: float,
+                 content_length: str | None):
+        self.url = url
+        self.stop_at = stop_at
+        self.max_bytes = max_bytes
+        self.content_length = content_length
+        self.read_bytes = 0
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        self._parts = []
+        self._length = 0
+        self._tail = ''
+        self._found = False
+        self._stopped = False
+        self._starts = [None] * len(stop_at or [])
+
+    def feed(self, chunk: bytes, downloaded: int) -> bool:
+        """
+        Takes the next chunk; `downloaded` is the body bytes received so far
+        (before any content decoding). Returns True once reading should stop.
+        """
+        self.read_bytes += len(chunk)
+        if not self._found:
+            text = self._decoder.decode(chunk)
+            self._parts.append(text)
+            window = self._tail + text
+            if self.stop_at and _markers_complete(window, self._length - len(self._tail), self.stop_at, self._starts):
+                self._found = True # From here on the rest is drained undecoded
+                if _stop_early(self.content_length, downloaded):
+                    logger.debug("Stopped reading %s early after %d bytes", self.url, self.read_bytes)
+                    self._stopped = True
+                    return True
+            self._length += len(text)
+            self._tail = window[-_MARKER_OVERLAP:]
+        if self.read_bytes >= self.max_bytes:
+            if not self._found:
+                logger.warning("Stopped reading %s at the %d byte limit", self.url, self.max_bytes)
+            self._stopped = True
+            return True
+        return False
+
+    def text(self) -> str:
+        """The page text read so far (all of it once the body has ended)."""
+        if not self._found and not self._stopped:
+            self._parts.append(self._decoder.decode(b'', final=True))
+            self._stopped = True
+        return ''.join(self._parts)
+
+
+def fetch_page(url: str, stop_at: list | None = None, encoding: str | None = None,
+               max_bytes: int = MAX_PAGE_BYTES, **kwargs) -> tuple[str, str]:
+    """
+    Downloads a page, decoding it only until the content we need has arrived
+    (see _stop_early for when the rest is skipped rather than drained).
+
+    Args:
+        url: The page to fetch.
+        stop_at: Stop markers (see UG_STORE_MARKERS); None reads the whole page.
+        encoding: Forces the text encoding, e.g. 'ISO-8859-1' for LaCuerda.
+            Defaults to the encoding requests derives from the headers.
+        max_bytes: Maximum number of body bytes to read.
+        **kwargs: Passed on to make_request (headers, timeout, ...).
+
+    Returns:
+        A (text, final url after redirects) tuple. The text may be truncated.
+
+    Raises:
+        requests.exceptions.RequestException: On network errors or bad status codes.
+    """
+    if not STREAM_PAGES:
+        response = make_request(url, **kwargs)
+        response.raise_for_status()
+        if encoding:
+            response.encoding = encoding
+        return response.text, response.url
+
+    with make_request(url, stream=True, **kwargs) as response:
+        response.raise_for_status()
+        reader = _PageReader(url, _page_encoding(encoding, response.headers), stop_at, max_bytes,
+                             response.headers.get('Content-Length'))
+        for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+            if reader.feed(chunk, response.raw.tell()):
+                break
+        return reader.text(), response.url
+
+
+# --- Search index ---
+# Every candidate a provider search returns is kept in SEARCH_INDEX, so a
+# repeat query (the same words, in any order) skips the search and fetches the
+# song page directly. Anything else is searched. See search_index.py.
+SEARCH_INDEX = search_index.SearchIndex(chord_cache.CACHE_PATH or None)
+
+
+def _page_gone(error: Exception) -> bool:
+    """Whether a fetch failed with 404 or 410 (a requests or an httpx status error)."""
+    response = getattr(error, 'response', None)
+    return response is not None and getattr(response, 'status_code', None) in (404, 410)
+
+
+# --- Provider steps ---
+# Each provider is written once, as a generator of "steps": it yields a
+# PageFetch for every page it needs and is sent back the (text, final url) of
+# that page, or has the fetch error thrown in. Everything between fetches
+# (parsing, the search index) happens inside the generator, so the engines only
+# differ in how they fetch: _run_steps here with requests, and
+# async_scraper._run_steps with httpx (advancing the steps in a worker thread).
+
+class PageFetch(NamedTuple):
+    """A page a provider's steps need."""
+    provider: str
+    stage: str # Metrics stage: 'search_fetch' or 'song_fetch'
+    url: str
+    stop_at: list | None
+    timeout: float
+    encoding: str | None = None
+
+
+def _indexed_steps(provider: str, query: str, cancel: threading.Event | None, search, song):
+    """
+    Runs a provider through the search index.
 
     Args:
+        provider: Provider name, the index namespace.
         query: The song title and artist.
+        cancel: Optional event set once another provider has already won.
+        search: Callable returning the provider's search steps, which return
+            (content, candidates), content being set when the search landed
+            straight on a song page.
+        song: Callable returning the steps that fetch and format the song
+            page for a candidate list.
+
+    Returns:
+        The formatted chords, or None if not found.
+    """
+    candidates = SEARCH_INDEX.lookup(provider, query)
+    if candidates is not None:
+        try:
+            return (yield from song(candidates))
+        except Exception as e:
+            if not _page_gone(e):
+                raise
+            logger.info("%s: Indexed song page is gone, searching again", provider)
+            SEARCH_INDEX.forget(provider, query)
+    content, candidates = yield from search()
+    SEARCH_INDEX.record(provider, query, candidates)
+    if content or not candidates or _cancelled(cancel):
+        return content
+    return (yield from song(candidates))
+
+
+def _advance(steps, result: tuple | None = None, error: Exception | None = None) -> tuple:
+    """
+    Runs provider steps up to their next fetch, sending in the last page (or
+    throwing in its error). Returns (PageFetch, None), or (None, content) once
+    the steps are done.
+    """
+    try:
+        return (steps.throw(error) if error is not None else steps.send(result)), None
+    except StopIteration as done:
+        return None, done.value
+
+
+def _run_steps(steps) -> str | None:
+    """Runs provider steps with the blocking fetch_page."""
+    fetch, content = _advance(steps)
+    while fetch is not None:
+        result, error = None, None
+        try:
+            with metrics.span(fetch.provider, fetch.stage):
+                result = fetch_page(fetch.url, stop_at=fetch.stop_at, encoding=fetch.encoding,
+                                    headers=HEADERS, timeout=fetch.timeout)
+        except requests.exceptions.RequestException as e:
+            error = e
+        fetch, content = _advance(steps, result, error)
+    return content
+
+
+# Provider names as they prefix error messages
+_ERROR_LABELS = {UG: 'UG', LACUERDA: 'LaCuerda', CIFRACLUB: 'CifraClub'}
+
+
+def _scrape_error(provider: str, error: Exception, network: bool = False, timed_out: bool = False) -> ScraperError:
+    """The ScraperError to report for an exception that escaped a provider's steps."""
+    label = _ERROR_LABELS[provider]
+    if timed_out:
+        return ScraperError(f"{label}: Request timed out.", outcome='timeout')
+    if network:
+        return ScraperError(f"{label}: Network error: {error}")
+    if isinstance(error, json.JSONDecodeError):
+        return ScraperError(f"{label}: Error parsing JSON data: {error}")
+    return ScraperError(f"{label}: An unexpected error occurred: {error}")
+
+
+def _scrape(provider: str, steps) -> str | None:
+    """
+    Runs a provider's steps with the blocking fetch_page.
 
     Returns:
         Formatted chords and lyrics as a string if found, otherwise None.
+
+    Raises:
+        ScraperError: If the song could not be scraped; the message says why.
     """
-    print(f"Trying LaCuerda.net for: {query}")
+    try:
+        return _run_steps(steps)
+    except ScraperError:
+        raise
+    except requests.exceptions.RequestException as e:
+        raise _scrape_error(provider, e, network=True, timed_out=_is_timeout(e)) from e
+    except Exception as e:
+        raise _scrape_error(provider, e) from e
+
+
+# --- Provider page parsing ---
+# Each provider is split into URL building and parsing helpers, which only deal
+# with HTML text, and steps that say which pages to fetch.
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
+}
+
+
+# --- LaCuerda Scraper ---
+
+def _lacuerda_search_url(query: str) -> str:
     # LaCuerda search usually works better if we split artist/song, but let's try combined first
     # A more robust approach might involve trying to parse artist/song from the query
     search_term = urllib.parse.quote(query)
-    search_url = f"https://lacuerda.net/BUSCADOR/index.php?keyword={search_term}"
+    return f"https://lacuerda.net/BUSCADOR/index.php?keyword={search_term}"
 
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
-    }
 
-    try:
-        # Use the helper function
-        search_response = make_request(search_url, headers=headers, timeout=10)
-        search_response.raise_for_status()
-        search_soup = BeautifulSoup(search_response.text, 'html.parser')
+_LACUERDA_TAB_LINK = re.compile(r'/tabs/')
+_LACUERDA_VERSION_SUFFIX = re.compile(r'\s*\(\d+\)$') # "Song (2)" -> "Song"
+
 
+def _lacuerda_candidates(search_html: str) -> list:
+    """Returns every song in LaCuerda search results, in their order."""
+    with metrics.span(LACUERDA, 'parse'):
+        search_soup = BeautifulSoup(search_html, 'html.parser')
+
+    with metrics.span(LACUERDA, 'extract'):
         # Find the results table
         results_table = search_soup.find('table', {'class': 'tbl'})
         if not results_table:
-            print("LaCuerda: No results table found.")
-            return None
-
-        # Find the first link within the results table (simplistic approach)
-        first_result_link = results_table.find('a', href=re.compile(r'/tabs/'))
-        if not first_result_link or not first_result_link.get('href'):
-            print("LaCuerda: No valid result link found in table.")
-            return None
+            logger.info("LaCuerda: No results table found.")
+            return []
+        candidates = []
+        for link in results_table.find_all('a', href=_LACUERDA_TAB_LINK):
+            # Ensure the URL is absolute
+            song_url = urllib.parse.urljoin("https://lacuerda.net/", link['href'])
+            # Song pages live at /tabs/<letter>/<artist>/<song>.shtml
+            path = urllib.parse.urlsplit(song_url).path.split('/')
+            artist = path[3].replace('_', ' ') if len(path) > 4 else ''
+            title = _LACUERDA_VERSION_SUFFIX.sub('', link.get_text(strip=True))
+            candidates.append(search_index.Candidate(song_url, title, artist))
+
+    if not candidates:
+        logger.info("LaCuerda: No valid result link found in table.")
+    return candidates
+
+
+def _lacuerda_song_url(search_html: str) -> str | None:
+    """Returns the absolute URL of the first song in LaCuerda search results, if any."""
+    candidates = _lacuerda_candidates(search_html)
+    if not candidates:
+        return None
+    logger.debug("LaCuerda: Found potential match: %s", candidates[0].url)
+    return candidates[0].url
 
-        song_rel_url = first_result_link['href']
-        # Ensure the URL is absolute
-        song_url = urllib.parse.urljoin("https://lacuerda.net/", song_rel_url)
-        print(f"LaCuerda: Found potential match: {song_url}")
 
-        # Fetch the song page using the helper function
-        song_response = make_request(song_url, headers=headers, timeout=10)
-        song_response.raise_for_status()
-        # LaCuerda often uses ISO-8859-1 encoding
-        song_response.encoding = 'ISO-8859-1'
-        song_soup = BeautifulSoup(song_response.text, 'html.parser')
+def _lacuerda_format(song_html: str) -> str | None:
+    """Extracts and cleans the chords from a LaCuerda song page."""
+    with metrics.span(LACUERDA, 'parse'):
+        song_soup = BeautifulSoup(song_html, 'html.parser')
 
+    with metrics.span(LACUERDA, 'extract'):
         # Find the <pre> tag containing the chords/lyrics
         pre_tag = song_soup.find('pre', id='tab_content')
         if not pre_tag:
-            print("LaCuerda: Could not find <pre id='tab_content'> tag.")
+            logger.info("LaCuerda: Could not find <pre id='tab_content'> tag.")
             return None
 
         # Extract text content
         # Replace <br> tags with newlines if necessary (BeautifulSoup often handles this)
         content = pre_tag.get_text(separator='\n').strip()
 
+    with metrics.span(LACUERDA, 'format'):
         # Basic formatting (remove potential ad lines, etc. - might need refinement)
         lines = content.splitlines()
         cleaned_lines = [line for line in lines if not line.strip().startswith(('lacuerda.net', 'ATENCION:', '-------'))]
-        formatted_content = "\n".join(cleaned_lines)
+        return "\n".join(cleaned_lines)
 
-        return formatted_content
 
-    except requests.exceptions.Timeout:
-        print("LaCuerda: Request timed out.")
-        return None
-    except requests.exceptions.RequestException as e:
-        print(f"LaCuerda: Network error: {e}")
-        return None
-    except Exception as e:
-        print(f"LaCuerda: An unexpected error occurred: {e}")
-        return None
+def _lacuerda_song_steps(song_url: str):
+    """Steps fetching and formatting a LaCuerda song page."""
+    # LaCuerda often uses ISO-8859-1 encoding
+    song_html, _ = yield PageFetch(LACUERDA, 'song_fetch', song_url, LACUERDA_SONG_MARKERS, LACUERDA_FETCH_TIMEOUT, 'ISO-8859-1')
+    return _lacuerda_format(song_html)
 
-# --- Cifra Club Scraper ---
 
-def _scrape_cifraclub(query: str) -> str | None:
+def _lacuerda_search_steps(query: str):
+    search_html, _ = yield PageFetch(LACUERDA, 'search_fetch', _lacuerda_search_url(query), LACUERDA_SEARCH_MARKERS, LACUERDA_FETCH_TIMEOUT)
+    return None, _lacuerda_candidates(search_html)
+
+
+def _lacuerda_steps(query: str, cancel: threading.Event | None = None):
+    """Steps scraping LaCuerda.net for `query` (see _indexed_steps)."""
+    logger.debug("Trying LaCuerda.net for: %s", query)
+    return _indexed_steps(LACUERDA, query, cancel, lambda: _lacuerda_search_steps(query),
+                          lambda candidates: _lacuerda_song_steps(candidates[0].url))
+
+
+def _scrape_lacuerda(query: str, cancel: threading.Event | None = None) -> str | None:
     """
-    Internal function to scrape CifraClub.com.
+    Internal function to scrape LaCuerda.net.
 
     Args:
         query: The song title and artist.
+        cancel: Optional event set once another provider has already won.
 
     Returns:
         Formatted chords and lyrics as a string if found, otherwise None.
+
+    Raises:
+        ScraperError: On network or unexpected errors.
     """
-    print(f"Trying CifraClub.com for: {query}")
+    return _scrape(LACUERDA, _lacuerda_steps(query, cancel))
+
+# --- Cifra Club Scraper ---
+
+def _cifraclub_search_url(query: str) -> str:
     # Cifra Club search needs the query formatted for the URL
     search_term = urllib.parse.quote(query)
     # Note: Cifra Club search might redirect. requests handles redirects by default.
-    search_url = f"https://www.cifraclub.com/find/?q={search_term}"
+    return f"https://www.cifraclub.com/find/?q={search_term}"
 
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
-    }
-
-    try:
-        # --- 1. Search ---
-        # Cifra Club's search might directly land on the song page if it's a good match,
-        # or show a search results page. We need to handle both.
-        # Use the helper function
-        search_response = make_request(search_url, headers=headers, timeout=15, allow_redirects=True)
-        search_response.raise_for_status()
-        search_soup = BeautifulSoup(search_response.text, 'html.parser')
-
-        # Check if we landed directly on a song page (look for the <pre> tag)
-        pre_tag = search_soup.find('pre')
-        song_url = search_response.url # The final URL after redirects
-
-        if pre_tag:
-             print(f"CifraClub: Directly landed on song page: {song_url}")
-             song_soup = search_soup # Use the current soup
-        else:
-            # --- If not direct, parse search results ---
-            print("CifraClub: Parsing search results page...")
-            # Find the first result link (this might need refinement based on actual page structure)
-            # Look for links within an ordered list <ol class="list-links">
-            results_list = search_soup.find('ol', class_='list-links')
-            first_result_link = None
-            if results_list:
-                first_result_link = results_list.find('a', href=True)
-
-            if not first_result_link:
-                print("CifraClub: No valid result link found on search page.")
-                return None
-
-            song_rel_url = first_result_link['href']
-            # Ensure the URL is absolute (relative to cifraclub.com)
-            song_url = urllib.parse.urljoin("https://www.cifraclub.com/", song_rel_url)
-            print(f"CifraClub: Found potential match link: {song_url}")
 
-            # --- 2. Fetch the song page ---
-            # Use the helper function
-            song_response = make_request(song_url, headers=headers, timeout=10)
-            song_response.raise_for_status()
-            # Cifra Club usually uses UTF-8, but let requests handle encoding detection
-            song_soup = BeautifulSoup(song_response.text, 'html.parser')
-            pre_tag = song_soup.find('pre') # Find the pre tag again
+# Chord diagram, key and section-label lines CifraClub puts around the song
+_CIFRACLUB_JUNK_LINE = re.compile(r'^\s*(\|--.*--\||Tom:|Intro:|Base:|Solo:)')
 
-        if not pre_tag:
-            print("CifraClub: Could not find <pre> tag on song page.")
-            return None
 
-        # --- 3. Extract and Format ---
+def _cifraclub_format_pre(pre_tag) -> str | None:
+    """Cleans the chords out of a CifraClub <pre> tag."""
+    with metrics.span(CIFRACLUB, 'extract'):
         # Replace <b> tags around chords with nothing
         for b_tag in pre_tag.find_all('b'):
             b_tag.replace_with(b_tag.text)
@@ -184,145 +615,264 @@ def _scrape_cifraclub(query: str) -> str | None:
         # Get text content, preserving line breaks
         content = pre_tag.get_text(separator='\n').strip()
 
+    with metrics.span(CIFRACLUB, 'format'):
         # Basic formatting (remove potential ad lines, etc. - might need refinement)
         lines = content.splitlines()
         # Example filter: remove lines that are just chord diagrams or ads
-        cleaned_lines = [line for line in lines if not re.match(r'^\s*(\|--.*--\||Tom:|Intro:|Base:|Solo:)', line.strip())]
+        cleaned_lines = [line for line in lines if not _CIFRACLUB_JUNK_LINE.match(line.strip())]
         formatted_content = "\n".join(cleaned_lines).strip()
 
-        # Check if content is substantial (sometimes empty <pre> tags exist)
-        if len(formatted_content) < 20:
-             print("CifraClub: Extracted content seems too short or empty.")
-             return None
+    # Check if content is substantial (sometimes empty <pre> tags exist)
+    if len(formatted_content) < 20:
+         logger.info("CifraClub: Extracted content seems too short or empty.")
+         return None
 
-        return formatted_content
+    return formatted_content
 
-    except requests.exceptions.Timeout:
-        print("CifraClub: Request timed out.")
-        return None
-    except requests.exceptions.RequestException as e:
-        print(f"CifraClub: Network error: {e}")
-        return None
-    except Exception as e:
-        print(f"CifraClub: An unexpected error occurred: {e}")
+
+def _cifraclub_parse_search(search_html: str, final_url: str) -> tuple[str | None, list]:
+    """
+    Parses the page CifraClub's search ended on.
+
+    Cifra Club's search might directly land on the song page if it's a good match,
+    or show a search results page. We need to handle both.
+
+    Returns:
+        (chords, [that page]) if we landed on a song page, (None, candidates)
+        for a results page, or (None, []) if neither worked out.
+    """
+    with metrics.span(CIFRACLUB, 'parse'):
+        search_soup = BeautifulSoup(search_html, 'html.parser')
+
+    # Check if we landed directly on a song page (look for the <pre> tag)
+    pre_tag = search_soup.find('pre')
+    if pre_tag:
+        logger.debug("CifraClub: Directly landed on song page: %s", final_url)
+        content = _cifraclub_format_pre(pre_tag)
+        return content, [search_index.Candidate(final_url)] if content else []
+
+    # --- If not direct, parse search results ---
+    logger.debug("CifraClub: Parsing search results page...")
+    with metrics.span(CIFRACLUB, 'extract'):
+        # Look for links within an ordered list <ol class="list-links">
+        results_list = search_soup.find('ol', class_='list-links')
+        candidates = []
+        for link in results_list.find_all('a', href=True) if results_list else ():
+            # Ensure the URL is absolute (relative to cifraclub.com)
+            song_url = urllib.parse.urljoin("https://www.cifraclub.com/", link['href'])
+            # Song pages live at /<artist>/<song>/
+            path = [part for part in urllib.parse.urlsplit(song_url).path.split('/') if part]
+            artist = path[0].replace('-', ' ') if len(path) >= 2 else ''
+            candidates.append(search_index.Candidate(song_url, link.get_text(' ', strip=True), artist))
+
+    if not candidates:
+        logger.info("CifraClub: No valid result link found on search page.")
+        return None, []
+
+    logger.debug("CifraClub: Found potential match link: %s", candidates[0].url)
+    return None, candidates
+
+
+def _cifraclub_format(song_html: str) -> str | None:
+    """Extracts and cleans the chords from a CifraClub song page."""
+    with metrics.span(CIFRACLUB, 'parse'):
+        song_soup = BeautifulSoup(song_html, 'html.parser')
+    pre_tag = song_soup.find('pre')
+    if not pre_tag:
+        logger.info("CifraClub: Could not find <pre> tag on song page.")
         return None
+    return _cifraclub_format_pre(pre_tag)
 
 
-# --- Combined Scraper ---
+def _cifraclub_song_steps(song_url: str):
+    """Steps fetching and formatting a CifraClub song page."""
+    # Cifra Club usually uses UTF-8, but let the headers decide
+    song_html, _ = yield PageFetch(CIFRACLUB, 'song_fetch', song_url, CIFRACLUB_SONG_MARKERS, CIFRACLUB_SONG_TIMEOUT)
+    return _cifraclub_format(song_html)
 
-def get_song_chords(query: str) -> str:
+
+def _cifraclub_search_steps(query: str):
+    # Redirects are followed, so this may end on a song page (see _cifraclub_parse_search)
+    search_html, final_url = yield PageFetch(CIFRACLUB, 'search_fetch', _cifraclub_search_url(query), CIFRACLUB_SEARCH_MARKERS, CIFRACLUB_SEARCH_TIMEOUT)
+    return _cifraclub_parse_search(search_html, final_url)
+
+
+def _cifraclub_steps(query: str, cancel: threading.Event | None = None):
+    """Steps scraping CifraClub.com for `query` (see _indexed_steps)."""
+    logger.debug("Trying CifraClub.com for: %s", query)
+    return _indexed_steps(CIFRACLUB, query, cancel, lambda: _cifraclub_search_steps(query),
+                          lambda candidates: _cifraclub_song_steps(candidates[0].url))
+
+
+def _scrape_cifraclub(query: str, cancel: threading.Event | None = None) -> str | None:
     """
-    Searches Ultimate Guitar, falling back to LaCuerda.net, then CifraClub.com,
-    and returns the formatted lyrics and chords.
+    Internal function to scrape CifraClub.com.
 
     Args:
-        query: The song title and artist (e.g., "Wonderwall Oasis").
+        query: The song title and artist.
+        cancel: Optional event set once another provider has already won.
 
     Returns:
-        A multiline string containing the formatted chords and lyrics,
-        or an error message if the song is not found on any site or scraping fails.
+        Formatted chords and lyrics as a string if found, otherwise None.
+
+    Raises:
+        ScraperError: On network or unexpected errors.
     """
-    print(f"--- Searching Ultimate Guitar for: {query} ---")
-    last_error = None # Store the last significant error
-    search_url = f"https://www.ultimate-guitar.com/search.php?search_type=title&value={urllib.parse.quote(query)}"
+    return _scrape(CIFRACLUB, _cifraclub_steps(query, cancel))
 
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
-    }
 
+# --- Ultimate Guitar Scraper ---
+
+# UG embeds its page data as JSON in <div class="js-store" data-content="...">.
+# The fast path finds that attribute with a plain string scan instead of
+# building a DOM for the whole (very large) page.
+_JS_STORE_MARKER = 'js-store'
+_DATA_CONTENT_ATTR = re.compile(r'\bdata-content\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+# Fallback when there's no js-store div: the store assigned in a <script>
+_UGAPP_STORE_SCRIPT = re.compile(r'window\.UGAPP\.store\.page')
+_UGAPP_STORE_JSON = re.compile(r'window\.UGAPP\.store\.page\s*=\s*(\{.*?\});', re.DOTALL)
+# Tab markup tags that are dropped from the chords
+_UG_TAB_TAG = re.compile(r'\[/?tab\]')
+
+
+def _extract_js_store(page_html: str) -> dict | None:
+    """
+    Fast path: pulls the js-store JSON out of a UG page without parsing it.
+
+    Returns:
+        The decoded JSON, or None if the div or its data could not be found or
+        decoded (callers then fall back to BeautifulSoup).
+    """
+    pos = page_html.find(_JS_STORE_MARKER)
+    while pos != -1:
+        tag_start = page_html.rfind('<', 0, pos)
+        tag_end = page_html.find('>', pos)
+        if tag_start != -1 and tag_end != -1 and page_html.startswith('<div', tag_start):
+            match = _DATA_CONTENT_ATTR.search(page_html, tag_start, tag_end)
+            if match:
+                raw = match.group(1) if match.group(1) is not None else match.group(2)
+                try:
+                    return json.loads(html.unescape(raw))
+                except json.JSONDecodeError:
+                    return None
+        pos = page_html.find(_JS_STORE_MARKER, pos + len(_JS_STORE_MARKER))
+    return None
+
+
+def _parse_ug_store(page_html: str, what: str) -> dict:
+    """
+    Returns the js-store JSON of a UG page, trying the fast scanner first
+    and falling back to a full BeautifulSoup parse.
+
+    Args:
+        page_html: The page source.
+        what: Describes the page in error messages ('search results' or 'tab content').
+
+    Raises:
+        ScraperError: If the JSON could not be found or decoded.
+    """
+    with metrics.span(UG, 'parse'):
+        return _parse_ug_store_untimed(page_html, what)
+
+
+def _parse_ug_store_untimed(page_html: str, what: str) -> dict:
+    data = _extract_js_store(page_html)
+    if data is not None:
+        return data
+
+    soup = BeautifulSoup(page_html, 'html.parser')
+    script_tag = soup.find('div', {'class': 'js-store'})
+
+    if not script_tag or not script_tag.get('data-content'):
+        # Fallback: Try finding script tag directly (less reliable)
+        script_tag_direct = soup.find('script', string=_UGAPP_STORE_SCRIPT)
+        if not script_tag_direct:
+            raise ScraperError(f"Could not find the js-store div or relevant script tag for {what}.")
+        json_text_match = _UGAPP_STORE_JSON.search(script_tag_direct.string)
+        if not json_text_match:
+            raise ScraperError(f"Could not extract JSON data pattern for {what} from script tag.")
+        try:
+            return json.loads(json_text_match.group(1))
+        except json.JSONDecodeError:
+            raise ScraperError(f"Failed to parse JSON data for {what} from script tag.")
+
+    # Preferred method: Parse from data-content attribute
     try:
-        # --- 1. Search for the song ---
-        # Use the helper function
-        search_response = make_request(search_url, headers=headers, timeout=15) # Added timeout
-        search_response.raise_for_status() # Raise an exception for bad status codes
-
-        search_soup = BeautifulSoup(search_response.text, 'html.parser')
-
-        # --- Find and parse the embedded JSON data ---
-        # UG often embeds data in a <script> tag. Let's find it.
-        script_tag = search_soup.find('div', {'class': 'js-store'})
-
-        if not script_tag or not script_tag.get('data-content'):
-             # Fallback: Try finding script tag directly (less reliable)
-             script_tag_direct = search_soup.find('script', string=re.compile(r'window\.UGAPP\.store\.page'))
-             if script_tag_direct:
-                 json_text_match = re.search(r'window\.UGAPP\.store\.page\s*=\s*(\{.*?\});', script_tag_direct.string, re.DOTALL)
-                 if json_text_match:
-                     try:
-                         data = json.loads(json_text_match.group(1))
-                     except json.JSONDecodeError:
-                         return "Failed to parse JSON data from script tag."
-                 else:
-                     return "Could not extract JSON data pattern from script tag."
-             else:
-                return "Could not find the js-store div or relevant script tag for search results."
-        else:
-             # Preferred method: Parse from data-content attribute
-             try:
-                 data = json.loads(script_tag['data-content'])
-             except json.JSONDecodeError:
-                 return "Failed to parse JSON data from js-store data-content."
+        return json.loads(script_tag['data-content'])
+    except json.JSONDecodeError:
+        raise ScraperError(f"Failed to parse JSON data for {what} from js-store data-content.")
+
 
+def _ug_search_url(query: str) -> str:
+    return f"https://www.ultimate-guitar.com/search.php?search_type=title&value={urllib.parse.quote(query)}"
 
+
+def _ug_candidates(search_html: str, query: str) -> list:
+    """
+    Returns every result in UG search results, with its type, rating and votes.
+
+    Raises:
+        ScraperError: If there are no results.
+    """
+    # --- Find and parse the embedded JSON data ---
+    data = _parse_ug_store(search_html, 'search results')
+
+    with metrics.span(UG, 'extract'):
         # Navigate through the JSON structure to find results
         # The exact path might change, adjust based on inspection if needed
         results = data.get('store', {}).get('page', {}).get('data', {}).get('results', [])
         if not results:
-            last_error = f"UG: No results found for '{query}'."
-            print(last_error)
-            # Don't return yet, try fallbacks
-
-        # Find the first 'Chords' type result
-        song_url = None
-        for result in results:
-            if result.get('type') == 'Chords':
-                song_url = result.get('tab_url')
-                if song_url:
-                    print(f"Found Chords tab: {song_url}")
-                    break
-
-        if not song_url:
-            last_error = f"UG: No 'Chords' tab found for '{query}'."
-            print(last_error)
-            # Don't return yet, try fallbacks
-
-        # --- 2. Fetch the song page ---
-        print(f"Fetching song page: {song_url}")
-        # Use the helper function
-        song_response = make_request(song_url, headers=headers, timeout=15) # Added timeout
-        song_response.raise_for_status()
-
-        song_soup = BeautifulSoup(song_response.text, 'html.parser')
-
-        # --- Find and parse the embedded JSON data for the tab ---
-        tab_script_div = song_soup.find('div', {'class': 'js-store'})
-
-        if not tab_script_div or not tab_script_div.get('data-content'):
-            # Fallback: Try finding script tag directly (less reliable)
-            tab_script_tag_direct = song_soup.find('script', string=re.compile(r'window\.UGAPP\.store\.page'))
-            if tab_script_tag_direct:
-                tab_json_match = re.search(r'window\.UGAPP\.store\.page\s*=\s*(\{.*?\});', tab_script_tag_direct.string, re.DOTALL)
-                if tab_json_match:
-                    try:
-                        tab_data = json.loads(tab_json_match.group(1))
-                    except json.JSONDecodeError:
-                        return "Failed to parse tab JSON data from script tag."
-                else:
-                    return "Could not extract tab JSON data pattern from script tag."
-            else:
-                return "Could not find the js-store div or relevant script tag for tab content."
-        else:
-            # Preferred method: Parse from data-content attribute
-            try:
-                tab_data = json.loads(tab_script_div['data-content'])
-            except json.JSONDecodeError:
-                return "Failed to parse tab JSON data from js-store data-content."
+            raise ScraperError(f"UG: No results found for '{query}'.", outcome='miss')
+        return [
+            search_index.Candidate(
+                result['tab_url'], result.get('song_name') or '', result.get('artist_name') or '',
+                result.get('type') or '', int(result.get('version') or 0),
+                float(result.get('rating') or 0), int(result.get('votes') or 0),
+            )
+            for result in results if result.get('tab_url')
+        ]
+
+
+def _ug_pick(candidates: list, query: str) -> str:
+    """
+    Returns the URL of the first 'Chords' tab among UG candidates.
 
+    Raises:
+        ScraperError: If none of them are chords.
+    """
+    # Find the first 'Chords' type result
+    for candidate in candidates:
+        if candidate.type == 'Chords':
+            logger.debug("Found Chords tab: %s", candidate.url)
+            return candidate.url
+    raise ScraperError(f"UG: No 'Chords' tab found for '{query}'.", outcome='miss')
 
+
+def _ug_tab_url(search_html: str, query: str) -> str:
+    """
+    Returns the URL of the first 'Chords' tab in UG search results.
+
+    Raises:
+        ScraperError: If there are no results or none of them are chords.
+    """
+    return _ug_pick(_ug_candidates(search_html, query), query)
+
+
+def _ug_format(song_html: str) -> str:
+    """
+    Extracts and formats the chords from a UG tab page.
+
+    Raises:
+        ScraperError: If the tab content could not be found.
+    """
+    # --- Find and parse the embedded JSON data for the tab ---
+    tab_data = _parse_ug_store(song_html, 'tab content')
+
+    with metrics.span(UG, 'extract'):
         # Navigate to the tab content - path might need adjustment
         tab_content_data = tab_data.get('store', {}).get('page', {}).get('data', {})
         if not tab_content_data:
-             return "Could not find 'data' object in tab JSON."
+             raise ScraperError("Could not find 'data' object in tab JSON.")
 
         # Try finding content in different possible locations within the JSON
         tab_content = tab_content_data.get('tab_view', {}).get('wiki_tab', {}).get('content', '')
@@ -334,57 +884,678 @@ def get_song_chords(query: str) -> str:
         if not tab_content and 'tab_view' in tab_content_data and 'content' in tab_content_data['tab_view']:
              tab_content = tab_content_data['tab_view']['content']
 
-        if not tab_content:
-            last_error = "UG: Could not extract tab content (lyrics and chords)."
-            print(last_error)
-            # Don't return yet, try fallbacks
-
-        # If we have UG content, format and return it
-        if tab_content:
-            # --- 3. Format the output ---
-            # The content often uses [ch]ChordName[/ch] tags. Replace them.
-            formatted_content = re.sub(r'\[ch\](.*?)\[/ch\]', r'\1', tab_content)
-            # Remove other tags like [tab]...[/tab] if necessary (optional)
-            formatted_content = re.sub(r'\[/?tab\]', '', formatted_content)
-            # Remove [Verse], [Chorus] etc. tags for cleaner output (optional)
-            # formatted_content = re.sub(r'\[/?(Verse|Chorus|Intro|Outro|Bridge|Instrumental)\]\s*', '', formatted_content)
-            print("UG: Success!")
-            return formatted_content.strip()
+    if not tab_content:
+        raise ScraperError("UG: Could not extract tab content (lyrics and chords).")
 
-    except requests.exceptions.RequestException as e:
-        last_error = f"UG: Network error: {e}"
-        print(last_error)
-    except json.JSONDecodeError as e:
-        last_error = f"UG: Error parsing JSON data: {e}"
-        print(last_error)
-    except Exception as e:
-        last_error = f"UG: An unexpected error occurred: {e}"
-        print(last_error)
-
-    # --- Fallback 1: LaCuerda ---
-    print("\n--- Trying LaCuerda.net as fallback ---")
-    lacuerda_result = _scrape_lacuerda(query)
-    if lacuerda_result:
-        print("LaCuerda: Success!")
-        return lacuerda_result
-    else:
-        print("LaCuerda: Failed.")
-        # Keep the last_error from UG if LaCuerda also failed
-
-    # --- Fallback 2: Cifra Club ---
-    print("\n--- Trying CifraClub.com as fallback ---")
-    cifraclub_result = _scrape_cifraclub(query)
-    if cifraclub_result:
-        print("CifraClub: Success!")
-        return cifraclub_result
-    else:
-        print("CifraClub: Failed.")
-        # If all failed, return the last significant error or a generic message
-        return last_error if last_error else f"Could not find '{query}' on Ultimate Guitar, LaCuerda.net, or CifraClub.com."
+    # --- 3. Format the output ---
+    with metrics.span(UG, 'format'):
+        # The [ch]ChordName[/ch] tags are kept: chord_sheet uses them to find
+        # the chords, and strips them when rendering.
+        # Remove other tags like [tab]...[/tab] if necessary (optional)
+        formatted_content = _UG_TAB_TAG.sub('', tab_content)
+        # Remove [Verse], [Chorus] etc. tags for cleaner output (optional)
+        # formatted_content = re.sub(r'\[/?(Verse|Chorus|Intro|Outro|Bridge|Instrumental)\]\s*', '', formatted_content)
+        return formatted_content.strip()
+
+
+def _ug_song_steps(song_url: str):
+    """Steps fetching and formatting a UG tab page."""
+    logger.debug("Fetching song page: %s", song_url)
+    song_html, _ = yield PageFetch(UG, 'song_fetch', song_url, UG_STORE_MARKERS, UG_FETCH_TIMEOUT)
+    return _ug_format(song_html)
+
+
+def _ug_search_steps(query: str):
+    search_html, _ = yield PageFetch(UG, 'search_fetch', _ug_search_url(query), UG_STORE_MARKERS, UG_FETCH_TIMEOUT)
+    return None, _ug_candidates(search_html, query)
+
+
+def _ug_steps(query: str, cancel: threading.Event | None = None):
+    """Steps scraping Ultimate-Guitar.com for `query` (see _indexed_steps)."""
+    logger.debug("Searching Ultimate Guitar for: %s", query)
+    return _indexed_steps(UG, query, cancel, lambda: _ug_search_steps(query),
+                          lambda candidates: _ug_song_steps(_ug_pick(candidates, query)))
+
+
+def _scrape_ultimate_guitar(query: str, cancel: threading.Event | None = None) -> str | None:
+    """
+    Internal function to scrape Ultimate-Guitar.com.
+
+    Args:
+        query: The song title and artist.
+        cancel: Optional event set once another provider has already won.
+
+    Returns:
+        Formatted chords and lyrics as a string if found, otherwise None.
+
+    Raises:
+        ScraperError: If the song could not be scraped; the message says why.
+    """
+    return _scrape(UG, _ug_steps(query, cancel))
+
+
+# --- Combined Scraper ---
+
+# Providers in their static priority order. SCHEDULER reorders them per query;
+# within one run an earlier provider's answer always wins.
+PROVIDERS = [
+    (UG, _scrape_ultimate_guitar),
+    (LACUERDA, _scrape_lacuerda),
+    (CIFRACLUB, _scrape_cifraclub),
+]
+
+# Each provider's steps (query, cancel), which async_scraper runs with its own client
+PROVIDER_STEPS = {
+    UG: _ug_steps,
+    LACUERDA: _lacuerda_steps,
+    CIFRACLUB: _cifraclub_steps,
+}
+
+# Rolling per-provider stats and circuit breakers, shared with async_scraper.
+# LaCuerda is moved up for Spanish-looking queries and CifraClub for Portuguese
+# ones; otherwise the static order holds unless a provider keeps failing.
+SCHEDULER = provider_scheduler.ProviderScheduler(languages={LACUERDA: 'es', CIFRACLUB: 'pt'})
+
+
+def _scheduler_metrics() -> list:
+    """Exposes the provider circuit states on /metrics."""
+    lines = [
+        "# HELP chordbot_provider_circuit_open Whether a provider is being skipped by its circuit breaker.",
+        "# TYPE chordbot_provider_circuit_open gauge",
+    ]
+    for name, stats in SCHEDULER.snapshot().items():
+        lines.append(f'chordbot_provider_circuit_open{{provider="{name}"}} {int(stats["circuit_open"])}')
+    return lines
+
+
+metrics.register_collector(_scheduler_metrics)
+
+
+def _try_provider(name: str, scraper, query: str, cancel: threading.Event | None,
+                  on_progress=None) -> tuple[str | None, str | None, str]:
+    """
+    Runs one provider and returns (content, error, outcome) instead of raising,
+    recording its outcome ('hit', 'miss', 'timeout', 'error', 'cancelled' or 'skipped').
+
+    `on_progress(provider, status, error)`, if given, is called with status
+    'trying' when the provider starts and with its outcome when it's done.
+    """
+    error = _provider_starting(name, on_progress)
+    if error:
+        return None, error, 'skipped'
+    content, error = None, None
+    start = time.monotonic()
+    with metrics.span(name, 'total'):
+        try:
+            content = scraper(query, cancel=cancel)
+            outcome = 'hit' if content else ('cancelled' if _cancelled(cancel) else 'miss')
+        except ScraperError as e:
+            error, outcome = str(e), e.outcome
+    _provider_finished(name, outcome, time.monotonic() - start, error, on_progress)
+    return content, error, outcome
+
+
+def _provider_starting(name: str, on_progress=None) -> str | None:
+    """
+    Checks a provider's circuit before running it (both engines). Returns the
+    error to report if it is open, else None after reporting it as 'trying'.
+    """
+    if not SCHEDULER.allow(name):
+        metrics.PROVIDER_OUTCOMES.inc(provider=name, outcome='skipped')
+        logger.info("%s: Skipped, circuit open", name)
+        error = f"{name} is temporarily unavailable."
+        if on_progress is not None:
+            on_progress(name, 'skipped', error)
+        return error
+    if on_progress is not None:
+        on_progress(name, 'trying', None)
+    return None
+
+
+def _provider_finished(name: str, outcome: str, seconds: float, error: str | None, on_progress=None):
+    """Records a provider attempt's outcome (both engines)."""
+    SCHEDULER.record(name, outcome, seconds)
+    metrics.PROVIDER_OUTCOMES.inc(provider=name, outcome=outcome)
+    if error:
+        logger.info("%s: %s", name, error)
+    if on_progress is not None:
+        on_progress(name, outcome, error)
+
+
+def _failed_outcome(outcomes: list) -> str:
+    """
+    The outcome of a lookup no provider answered (both engines): 'miss' only
+    if every provider said the song isn't there, else 'timeout' or 'error',
+    since a provider that didn't answer might have had it.
+    """
+    if all(outcome == 'miss' for outcome in outcomes):
+        return 'miss'
+    return 'timeout' if 'timeout' in outcomes else 'error'
+
+
+def _run_sequential(query: str, providers: list, on_progress=None) -> tuple[str | None, str | None, str | None, str]:
+    """
+    Tries each provider in turn and stops at the first one that succeeds.
+
+    Returns:
+        A (content, provider name, error, outcome) tuple. On failure the error
+        is the first provider error reported, if any, and the outcome is
+        'miss', 'timeout' or 'error' (see _failed_outcome).
+    """
+    errors, outcomes = [], []
+    for name, scraper in providers:
+        logger.debug("Trying %s", name)
+        content, error, outcome = _try_provider(name, scraper, query, None, on_progress)
+        if content:
+            logger.info("%s: Success!", name)
+            return content, name, None, 'hit'
+        logger.info("%s: Failed.", name)
+        outcomes.append(outcome)
+        if error:
+            errors.append(error)
+    return None, None, errors[0] if errors else None, _failed_outcome(outcomes)
+
+
+def _run_concurrent(query: str, providers: list, hedge_delay: float,
+                    on_progress=None) -> tuple[str | None, str | None, str | None, str]:
+    """
+    Runs the providers in parallel while keeping their priority order.
+
+    The next provider is started every `hedge_delay` seconds (all at once when
+    it is 0), or straight away once everything already running has failed.
+    A provider's result is only used when every provider ahead of it has
+    failed, so we wait on a higher-priority provider only while it can still
+    win. As soon as the winner is known the remaining providers are cancelled.
+
+    Returns:
+        A (content, provider name, error, outcome) tuple, like _run_sequential.
+    """
+    cancel = threading.Event()
+    executor = _provider_executor()
+    futures = []
+    next_launch = time.monotonic()
+    try:
+        while True:
+            result = _settled(providers, futures)
+            if result is not None:
+                return result
+
+            # Start the next provider if its hedge delay is up or everything before it failed
+            now = time.monotonic()
+            while len(futures) < len(providers) and (now >= next_launch or all(f.done() for f in futures)):
+                name, scraper = providers[len(futures)]
+                logger.debug("Starting %s", name)
+                futures.append(executor.submit(_try_provider, name, scraper, query, cancel, on_progress))
+                next_launch = now + hedge_delay
+
+            pending = [f for f in futures if not f.done()]
+            timeout = max(0.0, next_launch - time.monotonic()) if len(futures) < len(providers) else None
+            wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+    finally:
+        # Tell the losers to stop before their next fetch and don't wait for them
+        cancel.set()
+        for future in futures:
+            future.cancel()
+
+
+_provider_pool = None
+_provider_pool_lock = threading.Lock()
+
+
+def _provider_executor() -> ThreadPoolExecutor:
+    """The process's provider thread pool, created on first use (see after_fork)."""
+    global _provider_pool
+    with _provider_pool_lock:
+        if _provider_pool is None:
+            _provider_pool = ThreadPoolExecutor(max_workers=PROVIDER_WORKERS, thread_name_prefix='provider')
+        return _provider_pool
+
+
+def _settled(providers: list, futures: list) -> tuple | None:
+    """
+    Checks the finished providers of a concurrent run in priority order (both
+    engines; `futures` may be futures or asyncio tasks, in launch order).
+
+    Returns:
+        The run's (content, provider name, error, outcome) once it is decided, or
+        None while a provider that could still win is running or not started yet.
+    """
+    errors, outcomes = [], []
+    for (name, _), future in zip(providers, futures):
+        if not future.done():
+            return None
+        content, error, outcome = future.result()
+        if content:
+            logger.info("%s: Success!", name)
+            return content, name, None, 'hit'
+        outcomes.append(outcome)
+        if error:
+            errors.append(error)
+    if len(futures) < len(providers):
+        return None
+    return None, None, errors[0] if errors else None, _failed_outcome(outcomes)
+
+
+def _find_chords(query: str, mode: str | None = None, on_progress=None) -> tuple[str | None, str | None, str | None, str]:
+    """
+    Runs the providers according to `mode` (defaults to PROVIDER_MODE), in
+    the order SCHEDULER picks for the query. `on_progress` is passed on to
+    _try_provider for every provider.
+
+    Returns:
+        A (content, provider name, error, outcome) tuple. Content and provider
+        name are None if no provider found the song; the outcome then tells a
+        plain miss from providers that failed (see _failed_outcome).
+    """
+    mode = mode or PROVIDER_MODE
+    providers = SCHEDULER.order(query, PROVIDERS)
+    if mode == 'sequential':
+        return _run_sequential(query, providers, on_progress)
+    if mode == 'race':
+        return _run_concurrent(query, providers, 0.0, on_progress)
+    if mode == 'hedged':
+        return _run_concurrent(query, providers, HEDGE_DELAY, on_progress)
+    raise ValueError(f"Unknown provider mode '{mode}', expected one of {PROVIDER_MODES}")
+
+
+# Shared result cache, keyed by normalized query
+RESULT_CACHE = chord_cache.ChordCache()
+
+
+def _cache_metrics() -> list:
+    """Exposes the result cache counters on /metrics."""
+    lines = [
+        "# HELP chordbot_cache_events_total Result cache hits, misses and evictions by tier.",
+        "# TYPE chordbot_cache_events_total counter",
+    ]
+    for tier, stats in RESULT_CACHE.stats().items():
+        for event in ('hits', 'misses', 'evictions'):
+            lines.append(f'chordbot_cache_events_total{{tier="{tier}",event="{event}"}} {stats[event]}')
+    return lines
+
+
+metrics.register_collector(_cache_metrics)
+
+# Identical queries arriving together share one scrape, within this process
+# and (through a lock file) across gunicorn workers.
+# Seconds a worker waits for another worker's scrape of the same query (the lock file)
+LOCK_TIMEOUT = float(os.environ.get('CHORDBOT_LOCK_TIMEOUT', str(SCRAPE_WORST_SECONDS)))
+# Seconds a request waits for the scrape already running for its query. The
+# leader may first wait LOCK_TIMEOUT for the lock and then scrape itself, so
+# anything shorter would send followers away while the answer is still coming.
+SINGLEFLIGHT_TIMEOUT = float(os.environ.get('CHORDBOT_SINGLEFLIGHT_TIMEOUT', str(LOCK_TIMEOUT + SCRAPE_WORST_SECONDS)))
+_INFLIGHT = singleflight.SingleFlight()
+
+
+def _scrape_and_cache(query: str, mode: str | None, min_ttl: float = 0.0, on_progress=None,
+                      lock_key: str | None = None) -> chord_cache.CacheEntry:
+    """
+    Scrapes the providers and caches the result, holding the cross-worker lock for the query.
+
+    A cached entry with more than `min_ttl` seconds left (set by refreshes)
+    is returned instead of scraping. A failed scrape never replaces a stale
+    found result, so an upstream outage keeps serving the old chords.
+    `lock_key` replaces the normalized query as the lock name (refreshes
+    use their own, so user requests never queue behind a throttled refresh).
+    """
+    lock = None
+    if RESULT_CACHE.disk is not None:
+        lock = singleflight.FileLock(lock_key or chord_cache.normalize_query(query))
+        if lock.acquire(timeout=LOCK_TIMEOUT):
+            entry = _done_elsewhere(query, min_ttl)
+            if entry is not None:
+                lock.release()
+                return entry
+    try:
+        content, provider, error, outcome = _find_chords(query, mode, on_progress)
+        return _store_result(query, content, provider, error, outcome)
+    finally:
+        if lock is not None:
+            lock.release()
+
+
+def _done_elsewhere(query: str, min_ttl: float = 0.0) -> chord_cache.CacheEntry | None:
+    """
+    After waiting for a query's lock (both engines): the entry another worker
+    stored meanwhile, if it has more than `min_ttl` seconds left. Reads the
+    shared tier, since this process's memory copy may predate it.
+    """
+    entry = RESULT_CACHE.get_shared(query)
+    if entry is not None and entry.expires_at - time.time() > min_ttl:
+        return entry
+    return None
+
+
+def _store_result(query: str, content: str | None, provider: str | None, error: str | None,
+                  outcome: str) -> chord_cache.CacheEntry:
+    """
+    Caches a scrape's result (both engines) and returns the entry to serve.
+    A failed scrape never replaces a stale found result.
+    """
+    if content is None:
+        stale = RESULT_CACHE.get(query, allow_stale=True)
+        if stale is not None and stale.found:
+            logger.warning("Refresh of '%s' found nothing (%s); keeping the cached result", query, error)
+            return stale
+    return RESULT_CACHE.put(query, content, provider, error, outcome)
+
+
+def _waited_too_long(query: str) -> chord_cache.CacheEntry:
+    """The (uncached) entry for a lookup that gave up waiting for another request's scrape."""
+    logger.warning("Timed out waiting for in-flight search for: %s", query)
+    return chord_cache.CacheEntry(None, None, f"Timed out waiting for the search for '{query}'. Please try again.", time.time(), 'timeout')
+
+
+# --- Background Refresh ---
+# Expired results are served stale and refreshed off the request path; popular
+# queries are also re-scraped before they expire (see refresher.py).
+SERVE_STALE = RESULT_CACHE.stale_ttl > 0
+POPULARITY = refresher.PopularityTracker(RESULT_CACHE.disk.path if RESULT_CACHE.disk is not None else None)
+_REFRESH_LIMITER = refresher.HostRateLimiter()
+
+
+def _refresh(query: str) -> chord_cache.CacheEntry:
+    """
+    Re-scrapes `query` for the refresher. Providers are tried one at a time
+    (latency doesn't matter here) and every fetch waits for the per-host rate limit.
+
+    Refreshes coalesce under their own key: a user lookup for the same query
+    scrapes at full speed instead of waiting behind the rate limiter.
+    """
+    token = _FETCH_LIMITER.set(_REFRESH_LIMITER)
+    try:
+        key = 'refresh ' + chord_cache.normalize_query(query)
+        return _INFLIGHT.do(key, lambda: _scrape_and_cache(query, 'sequential', min_ttl=REFRESHER.refresh_ahead,
+                                                           lock_key=key),
+                            timeout=SINGLEFLIGHT_TIMEOUT)
+    finally:
+        _FETCH_LIMITER.reset(token)
+
+
+REFRESHER = refresher.Refresher(_refresh, RESULT_CACHE, POPULARITY)
+
+
+def _cached(query: str) -> chord_cache.CacheEntry | None:
+    """
+    Cache lookup shared by both engines: counts the query's popularity and,
+    for a stale entry, queues a background refresh.
+    """
+    POPULARITY.track(query)
+    if refresher.REFRESHER_ENABLED:
+        REFRESHER.start()
+    entry = RESULT_CACHE.get(query, allow_stale=SERVE_STALE)
+    if entry is not None and entry.expired:
+        REFRESHER.submit(query)
+    return entry
+
+
+def lookup_song_chords(query: str, mode: str | None = None, on_progress=None) -> chord_cache.CacheEntry:
+    """
+    Returns the cached result for `query`, scraping the providers on a miss.
+
+    Concurrent misses for the same normalized query are coalesced into a
+    single scrape; callers that wait longer than SINGLEFLIGHT_TIMEOUT get a
+    timeout error entry (which is not cached). An expired found result is
+    returned straight away while it is refreshed in the background.
+
+    Args:
+        query: The song title and artist.
+        mode: 'sequential', 'race' or 'hedged'. Defaults to PROVIDER_MODE.
+        on_progress: Optional callback(provider, status, error) for each
+            provider tried (see _try_provider). Not called on cache hits, nor
+            when the query joins another request's scrape.
+
+    Returns:
+        A CacheEntry with the provider's chords (or None if not found), the
+        provider that answered and the provider error, if any. UG content
+        keeps its [ch] markup; render it with song_sheet().
+    """
+    start = time.perf_counter()
+    entry = _cached(query)
+    if entry is not None:
+        logger.debug("Cache hit for: %s (%s)", query, entry.provider or 'not found')
+        metrics.LOOKUP_SECONDS.observe(time.perf_counter() - start, source='stale' if entry.expired else 'cache')
+        return entry
+    key = chord_cache.normalize_query(query)
+    try:
+        entry = _INFLIGHT.do(key, lambda: _scrape_and_cache(query, mode, on_progress=on_progress), timeout=SINGLEFLIGHT_TIMEOUT)
+    except TimeoutError:
+        entry = _waited_too_long(query)
+    metrics.LOOKUP_SECONDS.observe(time.perf_counter() - start, source='scrape')
+    return entry
+
+
+def get_song_chords(query: str, mode: str | None = None, transpose: int = 0, capo: int = 0) -> str:
+    """
+    Searches Ultimate Guitar, falling back to LaCuerda.net, then CifraClub.com,
+    and returns the formatted lyrics and chords.
+
+    Args:
+        query: The song title and artist (e.g., "Wonderwall Oasis").
+        mode: 'sequential', 'race' or 'hedged'. Defaults to PROVIDER_MODE.
+        transpose: Semitones to move the chords by.
+        capo: Capo fret; the chords are shown as the shapes to play with it.
+
+    Returns:
+        A multiline string containing the formatted chords and lyrics,
+        or an error message if the song is not found on any site or scraping fails.
+    """
+    entry = lookup_song_chords(query, mode)
+    sheet = song_sheet(entry)
+    if sheet is not None:
+        return sheet.text(transpose, capo)
+    return missing_message(query, entry)
+
+
+def song_sheet(entry: chord_cache.CacheEntry) -> chord_sheet.ChordSheet | None:
+    """The parsed chord sheet of a found entry (memoized), or None."""
+    return chord_sheet.parse(entry.content) if entry.content else None
+
+
+def missing_message(query: str, entry: chord_cache.CacheEntry) -> str:
+    """What to show for an entry without chords."""
+    # If all failed, return the first significant error or a generic message
+    return entry.error if entry.error else f"Could not find '{query}' on Ultimate Guitar, LaCuerda.net, or CifraClub.com."
+
+
+# --- Progress Streaming ---
+# Seconds between keepalive events while a lookup is running, so proxies don't drop idle streams
+STREAM_KEEPALIVE = float(os.environ.get('CHORDBOT_STREAM_KEEPALIVE', '10'))
+
+
+def stream_song_chords(query: str, mode: str | None = None, keepalive: float = STREAM_KEEPALIVE):
+    """
+    lookup_song_chords as a stream of events, for showing progress while the
+    providers are tried.
+
+    The lookup runs on its own thread (and keeps going, filling the cache, if
+    the consumer stops listening). A cache hit yields just the result.
+
+    Yields:
+        ('provider', {'provider': name, 'status': status, 'error': error}) for
+        each provider started ('trying') or finished (its outcome),
+        ('keepalive', None) after `keepalive` quiet seconds, and finally
+        ('result', CacheEntry).
+    """
+    events = queue.Queue()
+
+    def on_progress(provider, status, error):
+        events.put(('provider', {'provider': provider, 'status': status, 'error': error}))
+
+    def run():
+        try:
+            events.put(('result', lookup_song_chords(query, mode, on_progress)))
+        except Exception as e:
+            logger.exception("Streamed lookup failed for: %s", query)
+            events.put(('result', chord_cache.CacheEntry(None, None, f"An unexpected error occurred: {e}", time.time(), 'error')))
+
+    threading.Thread(target=run, name='stream-lookup', daemon=True).start()
+    while True:
+        try:
+            kind, data = events.get(timeout=keepalive)
+        except queue.Empty:
+            yield 'keepalive', None
+            continue
+        yield kind, data
+        if kind == 'result':
+            return
+
+
+# --- Alternate Versions ---
+# Song page steps by provider, for versions picked from the search index
+_SONG_STEPS = {
+    UG: _ug_song_steps,
+    LACUERDA: _lacuerda_song_steps,
+    CIFRACLUB: _cifraclub_song_steps,
+}
+
+
+def _index_metrics() -> list:
+    """Exposes the search index counters on /metrics."""
+    lines = [
+        "# HELP chordbot_search_index_events_total Search index lookups that skipped a provider search, and misses.",
+        "# TYPE chordbot_search_index_events_total counter",
+    ]
+    for event, count in SEARCH_INDEX.stats().items():
+        lines.append(f'chordbot_search_index_events_total{{event="{event}"}} {count}')
+    return lines
+
+
+metrics.register_collector(_index_metrics)
+
+
+def song_versions(query: str) -> dict:
+    """
+    The candidates each provider listed for `query` (or, with
+    CHORDBOT_INDEX_FUZZY_RATIO below 1, a near-identical query), best first,
+    without searching. Providers that haven't been
+    searched for it are left out; run lookup_song_chords first to fill the index.
+    """
+    versions = {}
+    for name, _ in PROVIDERS:
+        candidates = SEARCH_INDEX.lookup(name, query, fuzzy=True)
+        if candidates:
+            versions[name] = candidates
+    return versions
+
+
+def lookup_version(url: str) -> chord_cache.CacheEntry | None:
+    """
+    Returns the chords of one specific version, fetched straight from its
+    song page and cached under its URL.
+
+    Only URLs a provider search listed (see song_versions) are fetched, so
+    this can't be used to make the server request arbitrary pages.
+
+    Returns:
+        A CacheEntry, or None if `url` isn't a known candidate.
+    """
+    provider = SEARCH_INDEX.knows_url(url)
+    if provider is None:
+        return None
+    key = f"version {url}"
+    entry = RESULT_CACHE.get(key)
+    if entry is not None:
+        return entry
+    content, error, outcome = None, None, 'miss'
+    try:
+        content = _scrape(provider, _SONG_STEPS[provider](url))
+    except ScraperError as e:
+        error, outcome = str(e), e.outcome
+    if error:
+        logger.info("%s: %s", provider, error)
+    return RESULT_CACHE.put(key, content, provider, error, 'hit' if content else outcome)
+
+
+# --- Batch Lookups ---
+
+def iter_song_chords(queries: list, concurrency: int, timeout: float, mode: str | None = None):
+    """
+    Looks up several queries on a bounded thread pool and yields each result
+    as soon as it is ready, in completion order rather than input order.
+
+    Args:
+        queries: The song queries.
+        concurrency: Maximum number of lookups running at once.
+        timeout: Seconds for the whole batch; unfinished lookups are then
+            reported as timed out and abandoned.
+        mode: Provider mode passed on to lookup_song_chords.
+
+    Yields:
+        (index, query, CacheEntry) tuples, index being the query's position in `queries`.
+    """
+    executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='batch')
+    futures = {executor.submit(lookup_song_chords, query, mode): index for index, query in enumerate(queries)}
+    pending = set(futures)
+    try:
+        for future in as_completed(futures, timeout=timeout):
+            pending.discard(future)
+            index = futures[future]
+            try:
+                entry = future.result()
+            except Exception as e:
+                logger.exception("Batch lookup failed for: %s", queries[index])
+                entry = chord_cache.CacheEntry(None, None, f"An unexpected error occurred: {e}", time.time(), 'error')
+            yield index, queries[index], entry
+    except FuturesTimeoutError:
+        for future in sorted(pending, key=futures.get):
+            index = futures[future]
+            yield index, queries[index], chord_cache.CacheEntry(None, None, f"Timed out after {timeout}s.", time.time(), 'timeout')
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+# --- Preloading ---
+# With gunicorn's preload_app (see gunicorn.conf.py) this module is imported
+# once in the master. warm_up() fills the caches there, so every forked worker
+# starts warm and shares those pages copy-on-write; after_fork() then gives
+# each worker its own connections and threads.
+WARM_CACHE_ROWS = int(os.environ.get('CHORDBOT_WARM_CACHE_ROWS', '500'))
+
+
+def warm_up() -> dict:
+    """
+    Loads the newest cached results into memory, parses their chord sheets
+    and loads the search index signatures, then closes the connections this
+    opened so none are inherited by forked workers. Returns what was loaded.
+    """
+    entries = RESULT_CACHE.warm(min(WARM_CACHE_ROWS, RESULT_CACHE.memory.max_size))
+    for entry in entries[:chord_sheet.SHEET_CACHE_SIZE]:
+        chord_sheet.parse(entry.content)
+    warmed = {
+        'results': len(entries),
+        'sheets': min(len(entries), chord_sheet.SHEET_CACHE_SIZE),
+        'index_signatures': SEARCH_INDEX.warm(),
+    }
+    if RESULT_CACHE.disk is not None:
+        RESULT_CACHE.disk.close()
+    SEARCH_INDEX.close()
+    close_sessions()
+    logger.info("Warmed up: %s", warmed)
+    return warmed
+
+
+def after_fork():
+    """
+    Runs in each new worker process (gunicorn post_fork). Connection pools,
+    SQLite connections, locks and background threads from the parent are
+    dropped unused; they are recreated on first use in the worker.
+    """
+    global _sessions_lock, _provider_pool, _provider_pool_lock
+    _sessions.clear()
+    _sessions_lock = threading.Lock()
+    _provider_pool = None
+    _provider_pool_lock = threading.Lock()
+    if RESULT_CACHE.disk is not None:
+        RESULT_CACHE.disk.after_fork()
+    SEARCH_INDEX.after_fork()
+    POPULARITY.after_fork()
+    REFRESHER.after_fork()
 
 
 # --- Example Usage ---
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     # Example found on UG
     song_query_ug = "Wonderwall Oasis"
     print(f"\n>>> Testing Query: {song_query_ug}")